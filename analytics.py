@@ -0,0 +1,121 @@
+import calendar
+import functools
+from datetime import timedelta
+from typing import NamedTuple
+
+import pandas as pd
+
+import data_cache
+import database
+import perf
+
+# ----------------- SUMMARY ANALYTICS -----------------
+# Everything the Summary Analysis section shows, computed headlessly from one filter
+# set: per-zone totals are grouped once into zone-group × metric sums/means, and the
+# "Total Pumping per Zone" table is derived from the same pass. Critical SPS come from
+# their own indexed query (database.load_critical_sps).
+# Results depend only on the filters and the data generation, so they are memoised.
+MEASURES = ["pumping_mld", "income_mld", "supply_mld"]
+SUMMARY_CACHE_SIZE = 64
+
+
+class SummaryResult(NamedTuple):
+    zone_totals: pd.DataFrame       # zone -> summed measures (zones with data only)
+    group_stats: pd.DataFrame       # group -> (measure, sum|mean)
+    zone_table: pd.DataFrame        # "Total Pumping per Zone" rows
+    rows: int                       # station_logs rows behind the summary
+
+    def stat(self, group, measure, how="sum"):
+        # Missing groups sum to 0 and have no mean, like Series.sum()/.mean() on empty data
+        try:
+            return float(self.group_stats.at[group, (measure, how)])
+        except KeyError:
+            return 0.0 if how == "sum" else float("nan")
+
+
+def zone_group_index(zone_groups):
+    # {group: set(zones)} -> Series zone -> group
+    return pd.Series({zone: group for group, zones in zone_groups.items() for zone in zones}, dtype=object)
+
+
+@perf.timed()
+def summarize(zone_totals, zone_groups, rows):
+    # zone_totals: DataFrame indexed by zone with MEASURES columns (from the rollups or
+    # from the filtered rows); rows: the number of station_logs rows behind them.
+    group_of = zone_group_index(zone_groups)
+    groups = group_of.reindex(zone_totals.index).to_numpy()
+    known = pd.notna(groups)
+    group_stats = zone_totals.loc[known, MEASURES].groupby(groups[known]).agg(["sum", "mean"])
+
+    # Zone table: every SPS zone (0 when nothing was logged), the TSPS total, the plant row
+    sps_zones = sorted(zone_groups.get("sps", ()))
+    pumping = zone_totals["pumping_mld"].reindex(sps_zones, fill_value=0.0).to_numpy()
+    plant_income = _group_sum(group_stats, "plant", "income_mld")
+    plant_supply = _group_sum(group_stats, "plant", "supply_mld")
+    zone_table = pd.DataFrame({
+        "zone": sps_zones + ["tsps", "plant"],
+        "pumping_mld": list(pumping) + [_group_sum(group_stats, "tsps", "pumping_mld"), ""],
+        "income_mld": [""] * (len(sps_zones) + 1) + [plant_income],
+        "supply_mld": [""] * (len(sps_zones) + 1) + [plant_supply],
+    })
+    return SummaryResult(zone_totals, group_stats, zone_table, rows)
+
+
+def _group_sum(group_stats, group, measure):
+    return float(group_stats.at[group, (measure, "sum")]) if group in group_stats.index else 0.0
+
+
+@functools.lru_cache(maxsize=SUMMARY_CACHE_SIZE)
+def _cached_summary(generation, zone, sps_name, username, start_date, end_date, zone_groups_key):
+    zone_groups = {group: set(zones) for group, zones in zone_groups_key}
+    if username:
+        # Rollups aren't split by user, so per-user totals come from the rows themselves
+        summary_df = data_cache.load_station_frame(
+            zone=zone, sps_name=sps_name, username=username, start_date=start_date, end_date=end_date,
+        )
+        return summarize(summary_df.groupby("zone")[MEASURES].sum(), zone_groups, len(summary_df))
+    zone_totals = database.load_zone_totals(start_date, end_date, zone=zone, sps_name=sps_name).set_index("zone")
+    rows = int(zone_totals.pop("row_count").sum())
+    return summarize(zone_totals, zone_groups, rows)
+
+
+@perf.timed()
+def load_summary(start_date, end_date, zone_groups, zone=None, sps_name=None, username=None):
+    # Memoised per data generation; the result is shared between callers and must be
+    # treated as read-only. Entries from older generations age out of the LRU.
+    zone_groups_key = tuple(sorted((group, tuple(sorted(zones))) for group, zones in zone_groups.items()))
+    return _cached_summary(
+        database.get_data_generation(), zone, sps_name, username,
+        database.format_date(start_date), database.format_date(end_date), zone_groups_key,
+    )
+
+
+def clear_cache():
+    _cached_summary.cache_clear()
+
+
+# ----------------- PERIOD COMPARISON -----------------
+# Like-for-like, to-date periods: this week so far vs the same weekdays last week, and
+# this month so far vs the same days of that month last year.
+COMPARISONS = {
+    "week": "This week vs last week",
+    "year": "This month vs same month last year",
+}
+
+
+def comparison_periods(kind, today):
+    # Returns ((current_start, current_end), (previous_start, previous_end))
+    if kind == "week":
+        start = today - timedelta(days=today.weekday())
+        return (start, today), (start - timedelta(days=7), today - timedelta(days=7))
+    start = today.replace(day=1)
+    # 29 Feb compares with 28 Feb in a non-leap year
+    last_year_end = start.replace(year=start.year - 1,
+                                  day=min(today.day, calendar.monthrange(start.year - 1, start.month)[1]))
+    return (start, today), (start.replace(year=start.year - 1), last_year_end)
+
+
+@perf.timed()
+def load_period_comparison(kind, level, today, zone=None, sps_name=None, username=None):
+    current, previous = comparison_periods(kind, today)
+    return database.load_period_comparison(level, current, previous, zone=zone, sps_name=sps_name, username=username)
@@ -0,0 +1,455 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+import analytics
+import database
+import exports
+import snapshot
+import trends
+import write_queue
+
+# ----------------- HELPERS -----------------
+def _timeit(fn, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed / repeat * 1e6
+
+
+def _entry(i, username="bench"):
+    return {
+        "entry_date": (date(2024, 1, 1) + timedelta(days=i // 50)).strftime("%Y-%m-%d"),
+        "zone": "wz",
+        "username": username,
+        "sps_name": f"SPS {i % 50}",
+        "total_pumps": 4,
+        "working_pumps": 3,
+        "standby_pumps": 1,
+        "standby_um": 0,
+        "remarks": "",
+        "pumping_mld": 12.5,
+        "income_mld": 0.0,
+        "supply_mld": 0.0,
+    }
+
+
+def _use_mode(workdir, pooled):
+    # per-call mode reproduces the old behaviour: plain sqlite3.connect, default
+    # rollback journal, connection closed after every call.
+    database.close_connections()
+    database.POOLED_CONNECTIONS = pooled
+    database.SQLITE_PRAGMAS = dict(_DEFAULT_PRAGMAS) if pooled else {}
+    mode_dir = os.path.join(workdir, "pooled" if pooled else "per_call")
+    os.makedirs(mode_dir, exist_ok=True)
+    database.DB_PATH = os.path.join(mode_dir, "station_data.db")
+    database.USER_DB_PATH = os.path.join(mode_dir, "app_data.db")
+    database.init_db()
+    database.register_user("bench", "bench", "both", "benchmark")
+
+
+_DEFAULT_PRAGMAS = dict(database.SQLITE_PRAGMAS)
+
+# ----------------- SCENARIOS -----------------
+def bench_calls(repeat):
+    results = {
+        "get_user_section": _timeit(lambda i: database.get_user_section("bench"), repeat),
+        "authenticate_user": _timeit(lambda i: database.authenticate_user("bench", "bench"), repeat),
+        "save_station_entry": _timeit(lambda i: database.save_station_entry(_entry(i), database.SAVE_OVERWRITE), repeat),
+        "load_station_logs (1 day)": _timeit(
+            lambda i: database.load_station_logs(zone="wz", start_date="2024-01-02", end_date="2024-01-02"),
+            max(repeat // 10, 1)),
+    }
+    return results
+
+
+def bench_concurrent(writers, readers, per_thread):
+    errors = []
+    latencies = []
+    lock = threading.Lock()
+
+    def writer(n):
+        for i in range(per_thread):
+            start = time.perf_counter()
+            try:
+                database.save_station_entry(_entry(n * per_thread + i, f"w{n}"), database.SAVE_OVERWRITE)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        database.close_connections()
+
+    def reader(n):
+        for i in range(per_thread):
+            try:
+                database.get_user_section("bench")
+                database.load_station_logs(zone="wz", start_date="2024-01-01", end_date="2024-01-07")
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+        database.close_connections()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+    return elapsed, writers * per_thread / elapsed, p99 * 1000, len(errors)
+
+
+def bench_submitters(save, delete, submitters, per_thread):
+    # Shift-change burst: every submitter starts at once and saves per_thread entries
+    # (every fifth one is deleted again). Returns (elapsed s, writes/s, p50 ms, p99 ms, errors).
+    errors = []
+    latencies = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(submitters)
+
+    def submitter(n):
+        start_line.wait()
+        for i in range(per_thread):
+            entry = {**_entry(i, f"s{n}"), "sps_name": f"Load {n}"}
+            start = time.perf_counter()
+            try:
+                save(entry, database.SAVE_OVERWRITE)
+                if i % 5 == 4:
+                    delete(entry["entry_date"], entry["sps_name"])
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        database.close_connections()
+
+    threads = [threading.Thread(target=submitter, args=(n,)) for n in range(submitters)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+    writes = submitters * (per_thread + per_thread // 5)
+    return elapsed, writes / elapsed, p50 * 1000, p99 * 1000, len(errors)
+
+
+# ----------------- SYNTHETIC DATA -----------------
+def generate_logs(years, end_date=None, seed=42, missing_rate=0.02):
+    # Daily rows for every registry station over `years` years ending at end_date:
+    # pumping around 60-80% of design capacity with a weekly cycle and noise, plant
+    # income/supply instead of pumping, occasional missed days and pump outages.
+    rng = random.Random(seed)
+    end_date = end_date or date.today()
+    start_date = end_date - timedelta(days=365 * years - 1)
+    stations = database.get_station_registry().to_dict("records")
+    users = [f"operator{n}" for n in range(12)]
+    for offset in range((end_date - start_date).days + 1):
+        day = start_date + timedelta(days=offset)
+        weekly = 1.0 + 0.08 * ((day.weekday() - 3) / 3.0)
+        for station in stations:
+            if rng.random() < missing_rate:
+                continue
+            capacity = station["design_capacity_mld"]
+            if pd.isna(capacity):
+                capacity = rng.choice([20.0, 35.0, 50.0, 80.0])
+            flow = max(capacity * rng.uniform(0.6, 0.8) * weekly + rng.gauss(0, capacity * 0.05), 0.0)
+            total = rng.randint(3, 8)
+            working = max(total - rng.randint(0, 3), 0)
+            plant = station["zone_group"] == "plant"
+            yield {
+                "entry_date": day.strftime("%Y-%m-%d"),
+                "zone": station["zone"],
+                "username": rng.choice(users),
+                "sps_name": station["sps_name"],
+                "total_pumps": total,
+                "working_pumps": working,
+                "standby_pumps": total - working,
+                "standby_um": rng.randint(0, 1),
+                "remarks": "",
+                "pumping_mld": 0.0 if plant else round(flow, 2),
+                "income_mld": round(flow, 2) if plant else 0.0,
+                "supply_mld": round(flow * rng.uniform(0.9, 1.0), 2) if plant else 0.0,
+            }
+
+
+def build_dataset(workdir, years, partitioned=False):
+    database.close_connections()
+    database.clear_registry_cache()
+    dataset_dir = os.path.join(workdir, f"{years}y")
+    os.makedirs(dataset_dir, exist_ok=True)
+    database.DB_PATH = os.path.join(dataset_dir, "station_data.db")
+    database.USER_DB_PATH = os.path.join(dataset_dir, "app_data.db")
+    database.init_db()
+    start = time.perf_counter()
+    result = database.import_station_entries(generate_logs(years))
+    if partitioned:
+        database.rollover_partitions()
+    with database.connect(database.DB_PATH) as conn:
+        conn.execute("ANALYZE")
+    return result["inserted"], time.perf_counter() - start
+
+
+# ----------------- BENCHMARK SUITE -----------------
+def _median_time(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2], timings[0], timings[-1]
+
+
+def suite_operations(workdir):
+    today = date.today()
+    ranges = {
+        "7d": (today - timedelta(days=6), today),
+        "year": (today.replace(month=1, day=1), today),
+        "all": (date(1900, 1, 1), today),
+    }
+    export_path = os.path.join(workdir, "export.xlsx")
+    counter = iter(range(10 ** 9))
+
+    def save():
+        n = next(counter)
+        database.save_station_entry({**_entry(n, "bench"), "entry_date": f"1990-01-{n % 28 + 1:02d}",
+                                     "sps_name": f"Bench {n}"}, database.SAVE_OVERWRITE)
+
+    # An existing entry from the last week: edits and deletes rescore the days after it
+    recent = database.load_entry_page(start_date=today - timedelta(days=7), end_date=today, limit=1)
+    recent = {**recent.iloc[0].to_dict(), "entry_date": recent.iloc[0]["entry_date"].strftime("%Y-%m-%d")}
+
+    def overwrite_recent():
+        n = next(counter)
+        database.save_station_entry({**recent, "pumping_mld": 50.0 + n % 7}, database.SAVE_OVERWRITE)
+
+    def delete_and_restore_recent():
+        database.delete_station_entry(recent["entry_date"], recent["sps_name"])
+        database.save_station_entry(recent)
+
+    def save_and_delete():
+        n = next(counter)
+        entry = {**_entry(n, "bench"), "entry_date": "1990-02-01", "sps_name": f"Bench {n}"}
+        database.save_station_entry(entry)
+        database.delete_station_entry(entry["entry_date"], entry["sps_name"])
+
+    ops = {}
+    for label, (start, end) in ranges.items():
+        ops[f"load_station_logs[{label}]"] = lambda s=start, e=end: database.load_station_logs(start_date=s, end_date=e)
+        ops[f"snapshot_load[{label}]"] = lambda s=start, e=end: snapshot.load_station_logs(start_date=s, end_date=e)
+        ops[f"zone_totals[{label}]"] = lambda s=start, e=end: database.load_zone_totals(s, e)
+        ops[f"trend_zone[{label}]"] = lambda s=start, e=end: trends.load_trend("zone", s, e)
+        ops[f"trend_sps[{label}]"] = lambda s=start, e=end: trends.load_trend("sps", s, e)
+    zone_groups = database.get_zone_groups()
+    for label in ("7d", "year"):
+        ops[f"summary_analysis[{label}]"] = lambda r=ranges[label]: (
+            analytics.clear_cache(), analytics.load_summary(r[0], r[1], zone_groups))
+    ops["load_station_logs[zone, year]"] = lambda: database.load_station_logs(
+        zone="wz", start_date=ranges["year"][0], end_date=today)
+    # Recent Entries: the first page and a page deep into a year-wide Plant filter
+    ops["entry_page[plant, year, first]"] = lambda: database.load_entry_page(
+        zone="plant", start_date=ranges["year"][0], end_date=today, limit=51)
+    ops["entry_page[plant, year, 60 days back]"] = lambda: database.load_entry_page(
+        zone="plant", start_date=ranges["year"][0], end_date=today,
+        after=((today - timedelta(days=60)).isoformat(), ""), limit=51)
+    for kind, level in (("week", "zone"), ("year", "sps")):
+        ops[f"period_comparison[{kind}, {level}]"] = lambda k=kind, l=level: analytics.load_period_comparison(k, l, today)
+    ops["period_comparison_pandas[year, sps]"] = lambda: _pandas_period_comparison("sps", today)
+    ops["critical_sps[year]"] = lambda: database.load_critical_sps(ranges["year"][0], today)
+    ops["critical_sps_pandas[year]"] = lambda: _pandas_critical_sps(ranges["year"][0], today)
+    ops["flow_anomalies[year]"] = lambda: database.load_flow_anomalies(ranges["year"][0], today)
+    ops["rebuild_flow_stats"] = database.rebuild_flow_stats
+    ops["save_station_entry"] = save
+    # The snapshot rebuilds only the segment the save touched
+    ops["snapshot_refresh[save, 1990]"] = lambda: (save(), snapshot.refresh())
+    ops["snapshot_refresh[save, recent]"] = lambda: (overwrite_recent(), snapshot.refresh())
+    ops["save+delete_station_entry"] = save_and_delete
+    ops["overwrite_station_entry[recent]"] = overwrite_recent
+    ops["delete+restore_station_entry[recent]"] = delete_and_restore_recent
+    ops["entry_exists"] = lambda: database.entry_exists(today, "Ranip")
+    ops["completeness[month]"] = lambda: database.load_completeness(
+        [(r["zone"], r["sps_name"]) for r in database.get_station_registry().to_dict("records")],
+        today.replace(day=1), today)
+    ops["export_xlsx[year]"] = lambda: exports.export_station_logs(
+        export_path, start_date=ranges["year"][0], end_date=today)
+    return ops
+
+
+def _pandas_critical_sps(start_date, end_date):
+    # Baseline for critical_sps: the range's raw rows filtered in pandas, as the summary did
+    df = database.load_station_logs(start_date=start_date, end_date=end_date)
+    return df.loc[df["standby_pumps"].to_numpy() == 0]
+
+
+def _pandas_period_comparison(level, today):
+    # Baseline for period_comparison: both periods' raw rows loaded and compared in pandas
+    keys = ["zone"] if level == "zone" else ["zone", "sps_name"]
+    totals = []
+    for start, end in analytics.comparison_periods("year", today):
+        rows = database.load_station_logs(start_date=start, end_date=end)
+        totals.append(rows.groupby(keys)[analytics.MEASURES].sum())
+    current, previous = totals
+    return current.sub(previous, fill_value=0)
+
+
+def run_suite(years_list, runs, output, export_runs, partitioned=False):
+    workdir = tempfile.mkdtemp(prefix="stp_suite_")
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "pandas": pd.__version__,
+            "runs": runs,
+            "partitioned": partitioned,
+        },
+        "results": [],
+    }
+    try:
+        for years in years_list:
+            rows, build_seconds = build_dataset(workdir, years, partitioned)
+            print(f"\n=== {years} year(s): {rows:,} rows (built in {build_seconds:.1f}s) ===")
+            report["results"].append({"years": years, "rows": rows, "op": "bulk_import",
+                                      "median_s": build_seconds, "min_s": build_seconds, "max_s": build_seconds})
+            for name, fn in suite_operations(workdir).items():
+                n = export_runs if name.startswith("export") else runs
+                median, fastest, slowest = _median_time(fn, n)
+                print(f"{name:<34} {median * 1000:10.2f} ms  (min {fastest * 1000:.2f}, max {slowest * 1000:.2f})")
+                report["results"].append({"years": years, "rows": rows, "op": name,
+                                          "median_s": median, "min_s": fastest, "max_s": slowest})
+    finally:
+        database.close_connections()
+        shutil.rmtree(workdir, ignore_errors=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Results written to {output}")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare_reports(old_path, new_path, threshold):
+    with open(old_path) as f:
+        old = {(r["years"], r["op"]): r["median_s"] for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    regressions = 0
+    print(f"{'op':<34} {'years':>5} {'old ms':>10} {'new ms':>10} {'ratio':>7}")
+    for r in new:
+        before = old.get((r["years"], r["op"]))
+        if before is None:
+            continue
+        ratio = r["median_s"] / before if before else float("inf")
+        flag = "  ⚠️" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"{r['op']:<34} {r['years']:>5} {before * 1000:10.2f} {r['median_s'] * 1000:10.2f} {ratio:7.2f}{flag}")
+    return 1 if regressions else 0
+
+
+def run_connections(args):
+    workdir = tempfile.mkdtemp(prefix="stp_bench_")
+    try:
+        for pooled in (False, True):
+            _use_mode(workdir, pooled)
+            label = "pooled + WAL" if pooled else "connect-per-call"
+            print(f"\n=== {label} ===")
+            for name, (total, per_call_us) in bench_calls(args.repeat).items():
+                print(f"{name:<28} {per_call_us:10.1f} us/call  ({total:.3f}s total)")
+            elapsed, throughput, p99_ms, errors = bench_concurrent(args.writers, args.readers, args.per_thread)
+            print(f"concurrent {args.writers}w/{args.readers}r      {throughput:10.1f} writes/s  "
+                  f"p99 {p99_ms:.1f} ms  errors {errors}  ({elapsed:.2f}s)")
+    finally:
+        database.close_connections()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_write_queue(args):
+    workdir = tempfile.mkdtemp(prefix="stp_writes_")
+    modes = {
+        "connect-per-call": (database.save_station_entry, database.delete_station_entry),
+        "pooled, direct": (database.save_station_entry, database.delete_station_entry),
+        "write queue": (write_queue.save_station_entry, write_queue.delete_station_entry),
+    }
+    try:
+        for label, (save, delete) in modes.items():
+            _use_mode(os.path.join(workdir, label.replace(" ", "_").replace(",", "")),
+                      pooled=label != "connect-per-call")
+            for submitters in args.submitters:
+                elapsed, throughput, p50, p99, errors = bench_submitters(save, delete, submitters, args.per_thread)
+                print(f"{label:<18} {submitters:>4} submitters {throughput:9.1f} writes/s  "
+                      f"p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  errors {errors}  ({elapsed:.2f}s)")
+        write_queue.shutdown()
+        print(f"write queue: {write_queue.stats()}")
+    finally:
+        write_queue.shutdown()
+        database.close_connections()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data layer and analytics benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    conn = sub.add_parser("connections", help="compare connect-per-call with pooled WAL connections")
+    conn.add_argument("--repeat", type=int, default=2000)
+    conn.add_argument("--writers", type=int, default=20)
+    conn.add_argument("--readers", type=int, default=20)
+    conn.add_argument("--per-thread", type=int, default=50)
+
+    writes = sub.add_parser("write-queue", help="concurrent submit burst: direct writes vs the group-commit queue")
+    writes.add_argument("--submitters", type=int, nargs="+", default=[16, 64, 128])
+    writes.add_argument("--per-thread", type=int, default=20)
+
+    suite = sub.add_parser("suite", help="time the data layer on synthetic multi-year datasets")
+    suite.add_argument("--years", type=int, nargs="+", default=[1, 5, 20])
+    suite.add_argument("--runs", type=int, default=5)
+    suite.add_argument("--export-runs", type=int, default=1)
+    suite.add_argument("--output", default="benchmark_results.json")
+    suite.add_argument("--partitioned", action="store_true", help="archive years before the hot window first")
+
+    compare = sub.add_parser("compare", help="compare two suite result files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=1.25, help="flag ops slower by this ratio")
+
+    args = parser.parse_args()
+    if args.command == "connections":
+        run_connections(args)
+    elif args.command == "write-queue":
+        run_write_queue(args)
+    elif args.command == "suite":
+        run_suite(args.years, args.runs, args.output, args.export_runs, args.partitioned)
+    else:
+        return compare_reports(args.old, args.new, args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
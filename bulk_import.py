@@ -0,0 +1,137 @@
+import csv
+import io
+from datetime import date, datetime
+
+import database
+
+# ----------------- BULK IMPORT OF HISTORICAL LOGS -----------------
+# Reads CSV or XLSX files row by row (never the whole sheet at once), validates each
+# row against the zone -> SPS mapping, and hands the clean rows to
+# database.import_station_entries, which writes them in a single transaction.
+DATE_FORMATS = ["%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d/%m/%y", "%Y/%m/%d"]
+
+INT_FIELDS = ["total_pumps", "working_pumps", "standby_pumps", "standby_um"]
+FLOAT_FIELDS = ["pumping_mld", "income_mld", "supply_mld"]
+REQUIRED_FIELDS = ["entry_date", "zone", "sps_name"]
+
+# Header spellings used by the app's own Excel exports and the paper log sheets
+HEADER_ALIASES = {
+    "date": "entry_date",
+    "sps": "sps_name",
+    "standby_u/m": "standby_um",
+    "user": "username",
+}
+
+MAX_REPORTED_ERRORS = 200
+
+
+def _header_key(name):
+    key = str(name or "").strip().lower().replace(" ", "_")
+    return HEADER_ALIASES.get(key, key)
+
+
+def _iter_csv(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    header = [_header_key(h) for h in next(reader, [])]
+    for values in reader:
+        if any(v.strip() for v in values):
+            yield dict(zip(header, values))
+
+
+def _iter_xlsx(fileobj):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [_header_key(h) for h in next(rows, ())]
+        for values in rows:
+            if any(v not in (None, "") for v in values):
+                yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def iter_file_rows(fileobj, filename):
+    # Yields (line_number, raw_row_dict); line 1 is the header.
+    name = filename.lower()
+    if name.endswith(".csv"):
+        rows = _iter_csv(fileobj)
+    elif name.endswith((".xlsx", ".xlsm")):
+        rows = _iter_xlsx(fileobj)
+    else:
+        raise ValueError(f"Unsupported file type: {filename} (use .csv or .xlsx)")
+    for line, row in enumerate(rows, start=2):
+        yield line, row
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised date '{text}'")
+
+
+def _number(value, cast):
+    if value is None or str(value).strip() == "":
+        return cast(0)
+    return cast(float(value))
+
+
+def validate_rows(rows, zone_sps_map, default_username, errors):
+    # Turns raw rows into station_logs dicts. Zone and SPS names are matched
+    # case/whitespace-insensitively and stored with their canonical spelling.
+    # Invalid rows are appended to errors as (line, reason) and left out.
+    lookup = {
+        zone.strip().lower(): (zone, {sps.strip().lower(): sps for sps in names})
+        for zone, names in zone_sps_map.items()
+    }
+    for line, raw in rows:
+        try:
+            missing = [f for f in REQUIRED_FIELDS if raw.get(f) in (None, "")]
+            if missing:
+                raise ValueError(f"missing {', '.join(missing)}")
+            zone_key = str(raw["zone"]).strip().lower()
+            if zone_key not in lookup:
+                raise ValueError(f"unknown zone '{raw['zone']}'")
+            zone, sps_lookup = lookup[zone_key]
+            sps_key = str(raw["sps_name"]).strip().lower()
+            if sps_key not in sps_lookup:
+                raise ValueError(f"SPS '{raw['sps_name']}' is not in zone {zone}")
+
+            entry = {
+                "entry_date": _parse_date(raw["entry_date"]).strftime("%Y-%m-%d"),
+                "zone": zone,
+                "username": str(raw.get("username") or default_username),
+                "sps_name": sps_lookup[sps_key],
+                "remarks": str(raw.get("remarks") or ""),
+            }
+            for field in INT_FIELDS:
+                entry[field] = _number(raw.get(field), int)
+            for field in FLOAT_FIELDS:
+                entry[field] = _number(raw.get(field), float)
+        except (TypeError, ValueError) as e:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append((line, str(e)))
+            else:
+                errors.append(None)
+            continue
+        yield entry
+
+
+def import_file(fileobj, filename, zone_sps_map, default_username,
+                policy=database.IMPORT_SKIP, progress=None):
+    errors = []
+    rows = validate_rows(iter_file_rows(fileobj, filename), zone_sps_map, default_username, errors)
+    result = database.import_station_entries(rows, policy=policy, progress=progress)
+    result["invalid"] = len(errors)
+    result["errors"] = [e for e in errors if e is not None]
+    return result
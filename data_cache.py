@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import database
+import perf
+import snapshot
+
+# ----------------- STATION DATA CACHE -----------------
+# Process-wide cache of loaded + normalised station_logs frames, shared by every
+# Streamlit session in this process. Entries are keyed by the filter arguments and the
+# database's data generation (bumped by a trigger on every insert/update/delete), so
+# any write makes older entries unreachable immediately; they are dropped on the next
+# lookup. Size is bounded both by entry count and by DataFrame memory, evicting the
+# least recently used filter key first.
+MAX_ENTRIES = 32
+MAX_BYTES = 256 * 1024 * 1024
+
+NUMERIC_COLUMNS = ["pumping_mld", "income_mld", "supply_mld", "standby_pumps"]
+
+_lock = threading.Lock()
+_entries = OrderedDict()        # (generation, filters) -> (frame, nbytes)
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "bytes": 0}
+
+
+@perf.timed()
+def normalize_station_frame(df):
+    # Zones are stored lower-case and SPS names come from the station registry, so
+    # only NULL measurements need filling in.
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0)
+    return df
+
+
+def _evict(key):
+    _, nbytes = _entries.pop(key)
+    _stats["bytes"] -= nbytes
+
+
+def _drop_stale(generation):
+    for key in [k for k in _entries if k[0] != generation]:
+        _evict(key)
+        _stats["invalidations"] += 1
+
+
+@perf.timed()
+def load_station_frame(zone=None, start_date=None, end_date=None, sps_name=None, username=None):
+    # Same filters as database.load_station_logs, read from the columnar snapshot;
+    # returns a private copy the caller may modify.
+    filters = (
+        zone.strip().lower() if zone else None,
+        database.format_date(start_date),
+        database.format_date(end_date),
+        sps_name,
+        username,
+    )
+    generation = database.get_data_generation()
+    key = (generation, filters)
+
+    with _lock:
+        _drop_stale(generation)
+        cached = _entries.get(key)
+        if cached is not None:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return cached[0].copy()
+        _stats["misses"] += 1
+
+    df = normalize_station_frame(snapshot.load_station_logs(
+        zone=zone, start_date=start_date, end_date=end_date, sps_name=sps_name, username=username,
+    ))
+    nbytes = int(df.memory_usage(deep=True).sum())
+
+    with _lock:
+        if nbytes <= MAX_BYTES and key not in _entries:
+            _entries[key] = (df, nbytes)
+            _stats["bytes"] += nbytes
+            while len(_entries) > MAX_ENTRIES or _stats["bytes"] > MAX_BYTES:
+                _evict(next(iter(_entries)))
+                _stats["evictions"] += 1
+    return df.copy()
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _stats["bytes"] = 0
+
+
+def cache_stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": len(_entries),
+            "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+        }
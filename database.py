@@ -1,7 +1,14 @@
 import sqlite3
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import NamedTuple
+import numpy as np
 import pandas as pd
 import os
+import re
+import perf
+@perf.timed()
 def init_db():
     init_user_db()
     init_station_db()
@@ -10,9 +17,66 @@ def init_db():
 DB_PATH = "station_data.db"       # for station logs
 USER_DB_PATH = "app_data.db"      # for user login/register
 
+# ----------------- CONNECTIONS -----------------
+# One long-lived connection per (thread, database file). Streamlit runs every script
+# rerun on its own thread, so all the lookups made during one rerun share a connection
+# instead of reconnecting for each call. Set POOLED_CONNECTIONS = False to go back to
+# connect-per-call (used by benchmark.py for comparison).
+POOLED_CONNECTIONS = True
+BUSY_TIMEOUT_MS = 5000
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",        # readers don't block the writer and vice versa
+    "synchronous": "NORMAL",      # safe with WAL, avoids an fsync per commit
+    "busy_timeout": BUSY_TIMEOUT_MS,
+    "cache_size": -20000,         # ~20 MB page cache
+    "mmap_size": 268435456,       # 256 MB memory-mapped reads
+    "temp_store": "MEMORY",
+}
+
+_local = threading.local()
+
+def _open_connection(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    for pragma, value in SQLITE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma}={value}")
+    return conn
+
+def _pooled_connection(path):
+    pool = getattr(_local, "connections", None)
+    if pool is None:
+        pool = _local.connections = {}
+    key = os.path.abspath(path)
+    conn = pool.get(key)
+    if conn is None:
+        conn = pool[key] = _open_connection(path)
+    return conn
+
+@contextmanager
+def connect(path):
+    # Same semantics as "with sqlite3.connect(path) as conn": commit on success,
+    # rollback on error. Pooled connections stay open for the next call.
+    if POOLED_CONNECTIONS:
+        conn = _pooled_connection(path)
+        with conn:
+            yield conn
+    else:
+        conn = _open_connection(path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+def close_connections():
+    pool = getattr(_local, "connections", None) or {}
+    for conn in pool.values():
+        conn.close()
+    pool.clear()
+
 # ----------------- USER TABLE -----------------
 def init_user_db():
-    with sqlite3.connect(USER_DB_PATH) as conn:
+    with connect(USER_DB_PATH) as conn:
         conn.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 username TEXT PRIMARY KEY,
@@ -22,140 +86,1677 @@ def init_user_db():
                 timestamp TEXT
             )
         """)
+        _create_users_generation(conn)
         conn.commit()
 
-# ----------------- STATION LOGS TABLE -----------------
-def init_station_db():
-    with sqlite3.connect(DB_PATH) as conn:
+# ----------------- DATE STORAGE -----------------
+# entry_date stays the ISO text key; entry_day is a virtual generated column holding
+# days since 1970-01-01. Range filters and indexes use entry_day, and loaders turn it
+# straight into datetime64 without parsing any strings.
+ENTRY_DAY_SQL = "GENERATED ALWAYS AS (CAST(julianday(entry_date) - 2440587.5 AS INTEGER)) VIRTUAL"
+EPOCH = date(1970, 1, 1)
+
+def day_number(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date):
+        value = date.fromisoformat(str(value)[:10])
+    return (value - EPOCH).days
+
+def days_to_datetime(series):
+    return pd.to_datetime(series, unit="D")
+
+# ----------------- STATION REGISTRY -----------------
+# zones and stations are dimension tables with integer keys; station_logs rows carry the
+# station_id, and the SPS rollup, critical SPS and flow statistics group and join on it.
+# The registry is seeded with the stations the field teams currently log.
+# zone_group says which summary a zone belongs to (SPS, TSPS or Plant).
+DEFAULT_ZONES = [
+    ("WZ", "sps", ["Ranip", "Chenpur", "Motera", "Keshavnagar", "Sharda", "Paldi Shantivan"]),
+    ("EZ", "sps", ["Rakhiyal", "Viratnagar", "Ambikanagar", "Rabari Vasahat", "Arbuda Nagar"]),
+    ("SZ", "sps", ["Maninagar", "Vatva Nigam", "Isanpur-2"]),
+    ("NZ", "sps", ["Naroda Gayatri", "Ambawadi"]),
+    ("CZ", "sps", ["Shahibag", "Dariyapur", "Mirzapur"]),
+    ("SWZ", "sps", ["Juhapura", "Vejalpur"]),
+    ("NWZ", "sps", ["Ghuma", "Vasantnagar Gota"]),
+    ("SR", "sps", ["W-5"]),
+    ("TSPS", "tsps", [
+        "Jamalpur", "106 MLD", "NSP", "Danilimda", "Ambedkar", "180 MLD Pirana",
+        "Pirana terminal", "Saijpur 7", "Maleksaban 30", "Kotarpur 60", "100 MLD Vinzol",
+        "102 MLD Vinzol", "Lambha 17.50MLD", "SRFDCL E3", "Dafnala 25", "SRFDCL V.Baraj",
+        "Vasna Auda 126 mld", "285 MLD Vasna", "Vasna 76 mld", "Jalvihar 60"
+    ]),
+    ("Plant", "plant", [
+        "Old Pirana-106 MLD", "Old Pirana- 60 MLD", "New Pirana-180 MLD", "New Pirana-155 MLD",
+        "Saijpur-7 MLD", "Maleksaban-30 MLD", "Kotarpur-60 MLD", "Vinzol-100 MLD",
+        "Vinzol-70 MLD", "Vinzol-35 MLD", "Lambha-5 MLD", "Shankarbhuvan-25 MLD",
+        "Dafnala-25 MLD", "Vasna-35 MLD", "Vasna-126 MLD", "Vasna-240 MLD",
+        "Vasna-48 MLD", "Jalvihar-60 MLD"
+    ]),
+]
+
+def _capacity_from_name(name):
+    match = re.search(r"(\d+(?:\.\d+)?)\s*mld", name, re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+def _create_registry(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS zones (
+            zone_id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL,
+            zone_key TEXT NOT NULL UNIQUE,
+            zone_group TEXT NOT NULL,
+            sort_order INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stations (
+            station_id INTEGER PRIMARY KEY,
+            zone_id INTEGER NOT NULL REFERENCES zones (zone_id),
+            name TEXT NOT NULL,
+            name_key TEXT NOT NULL,
+            design_capacity_mld REAL,
+            sort_order INTEGER NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1,
+            UNIQUE (zone_id, name_key)
+        )
+    """)
+    if conn.execute("SELECT COUNT(*) FROM zones").fetchone()[0]:
+        return
+    for zone_order, (code, group, names) in enumerate(DEFAULT_ZONES):
+        zone_id = conn.execute(
+            "INSERT INTO zones (code, zone_key, zone_group, sort_order) VALUES (?, ?, ?, ?)",
+            (code, code.lower(), group, zone_order)
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO stations (zone_id, name, name_key, design_capacity_mld, sort_order) VALUES (?, ?, ?, ?, ?)",
+            [(zone_id, name, normalize_sps_name(name), _capacity_from_name(name), order)
+             for order, name in enumerate(names)]
+        )
+
+_registry_lock = threading.Lock()
+_registry_cache = {}
+
+@perf.timed()
+def get_station_registry():
+    # Cached per process and database file; add_station clears it.
+    key = os.path.abspath(DB_PATH)
+    with _registry_lock:
+        if key not in _registry_cache:
+            with connect(DB_PATH) as conn:
+                _registry_cache[key] = pd.read_sql_query("""
+                    SELECT s.station_id, z.zone_id, z.code AS zone_code, z.zone_key AS zone, z.zone_group,
+                           s.name AS sps_name, s.design_capacity_mld
+                    FROM stations s JOIN zones z ON z.zone_id = s.zone_id
+                    WHERE s.active = 1
+                    ORDER BY z.sort_order, s.sort_order
+                """, conn)
+        return _registry_cache[key]
+
+def clear_registry_cache():
+    with _registry_lock:
+        _registry_cache.clear()
+
+@perf.timed()
+def add_station(zone_code, name, design_capacity_mld=None):
+    # Registers an SPS and links the entries already logged under it (archived years
+    # too); the rollups and its flow statistics are brought up to date for them.
+    zone_key, name_key = zone_code.strip().lower(), normalize_sps_name(name)
+    link = "UPDATE station_logs SET station_id = ? WHERE station_id IS NULL AND zone = ? AND lower(trim(sps_name)) = ?"
+    archives = _log_sources()[:-1]
+    with connect(DB_PATH) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        zone = conn.execute("SELECT zone_id FROM zones WHERE zone_key = ?", (zone_key,)).fetchone()
+        if zone is None:
+            raise ValueError(f"Unknown zone: {zone_code}")
+        next_order = conn.execute("SELECT COALESCE(MAX(sort_order), -1) + 1 FROM stations WHERE zone_id = ?",
+                                  (zone[0],)).fetchone()[0]
+        station_id = conn.execute(
+            "INSERT INTO stations (zone_id, name, name_key, design_capacity_mld, sort_order) VALUES (?, ?, ?, ?, ?)",
+            (zone[0], name.strip(), name_key, design_capacity_mld, next_order)
+        ).lastrowid
+        archived = 0
+        for path in archives:
+            with connect(path) as archive:
+                archived += archive.execute(link, (station_id, zone_key, name_key)).rowcount
+        # Hot rows reach the rollups through the update triggers; archived ones don't
+        linked = conn.execute(link, (station_id, zone_key, name_key)).rowcount + archived
+        if archived:
+            _rebuild_rollups(conn)
+        if linked:
+            _rebuild_flow_stats(conn, [station_id])
+    clear_registry_cache()
+    return station_id
+
+# ----------------- SCHEMA MIGRATIONS -----------------
+# PRAGMA user_version records which migrations a station database has been through,
+# so init_station_db (called on every rerun) only does the table rewrites once.
+STATION_SCHEMA_VERSION = 9
+
+def _migrate_station_db(conn):
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    if current < 1:
+        # Older databases were created without the primary key and version column.
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(station_logs)")]
+        if "version" not in columns:
+            conn.execute("ALTER TABLE station_logs ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
         conn.execute("""
-            CREATE TABLE IF NOT EXISTS station_logs (
-                entry_date TEXT,
-                zone TEXT,
-                username TEXT,
-                sps_name TEXT,
-                total_pumps INTEGER,
-                working_pumps INTEGER,
-                standby_pumps INTEGER,
-                standby_um INTEGER,
-                remarks TEXT,
-                pumping_mld REAL,
-                income_mld REAL,
-                supply_mld REAL,
-                PRIMARY KEY (entry_date, sps_name)
+            DELETE FROM station_logs WHERE rowid NOT IN (
+                SELECT MAX(rowid) FROM station_logs GROUP BY entry_date, sps_name
             )
         """)
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_station_logs_date_sps ON station_logs (entry_date, sps_name)")
+        # Zones are compared lower-cased everywhere; keep stored values canonical so the
+        # zone index can be used with a plain equality lookup.
+        conn.execute("UPDATE station_logs SET zone = lower(trim(zone)) WHERE zone <> lower(trim(zone))")
+    # 2 filled the rollups from existing history by SPS name; 9 refills them by station_id
+    if current < 3:
+        # Integer day numbers for range scans; the text-date composite indexes are
+        # replaced by day-number ones.
+        columns = [row[1] for row in conn.execute("PRAGMA table_xinfo(station_logs)")]
+        if "entry_day" not in columns:
+            conn.execute(f"ALTER TABLE station_logs ADD COLUMN entry_day INTEGER {ENTRY_DAY_SQL}")
+        for index in ("idx_station_logs_zone_date", "idx_station_logs_user_date", "idx_station_logs_sps_date"):
+            conn.execute(f"DROP INDEX IF EXISTS {index}")
+    if current < 4:
+        # Link existing rows to the station registry
+        columns = [row[1] for row in conn.execute("PRAGMA table_xinfo(station_logs)")]
+        if "station_id" not in columns:
+            conn.execute("ALTER TABLE station_logs ADD COLUMN station_id INTEGER REFERENCES stations (station_id)")
+        _create_registry(conn)
+        conn.execute(f"UPDATE station_logs SET station_id = {station_id_sql('station_logs.zone', 'station_logs.sps_name')}")
+    # 5 seeded per-year change counters, replaced by the per-month ones in 8
+    # 6 scored the existing history by SPS name; 9 rescores it by station_id
+    if current < 7:
+        # Archives written before the critical-day index existed
+        for year in _archived_years(conn):
+            with connect(partition_path(year)) as archive:
+                _create_station_indexes(archive)
+    if current < 8:
+        # Snapshot segments went from one per year to one per month
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_log_year_generation_{event}")
+        conn.execute("DROP TABLE IF EXISTS log_year_generation")
+        _seed_month_generations(conn)
+    if current < 9:
+        # The SPS rollup and the flow statistics are keyed by station_id: recreate them
+        # and fill them once from whatever history the database already has. Triggers
+        # and writes keep them current from here on.
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_sps_daily_rollup_{event}")
+        for table in ("sps_daily_rollup", "flow_stats", "flow_anomalies"):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        _create_rollups(conn)
+        _rebuild_rollups(conn)
+        _create_flow_stats(conn)
+        _rebuild_flow_stats(conn)
+    conn.execute(f"PRAGMA user_version = {STATION_SCHEMA_VERSION}")
+
+# ----------------- DATA GENERATION -----------------
+# A single counter bumped by triggers on every change to station_logs. Caches key their
+# entries on it, so a write from any session or process invalidates them at once.
+def _create_data_generation(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO data_generation (id, generation) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_data_generation_{event.lower()} AFTER {event} ON station_logs BEGIN
+                UPDATE data_generation SET generation = generation + 1 WHERE id = 1;
+            END
+        """)
+
+@perf.timed()
+def get_data_generation():
+    with connect(DB_PATH) as conn:
+        row = conn.execute("SELECT generation FROM data_generation WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+# Per-month change counters, bumped by the same writes, so a reader that keeps a copy of
+# the data split by month (snapshot.py) knows which months to refresh. Months are
+# YYYYMM integers.
+MONTH_SQL = "CAST(substr({row}.entry_date, 1, 4) || substr({row}.entry_date, 6, 2) AS INTEGER)"
+
+def _month_generation_sql(row):
+    return f"""
+        INSERT INTO log_month_generation (month, generation) VALUES ({MONTH_SQL.format(row=row)}, 1)
+        ON CONFLICT (month) DO UPDATE SET generation = generation + 1;
+    """
+
+def _create_month_generations(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS log_month_generation (
+            month INTEGER PRIMARY KEY,
+            generation INTEGER NOT NULL
+        )
+    """)
+    for event, rows in (("INSERT", ["new"]), ("DELETE", ["old"]), ("UPDATE", ["old", "new"])):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_log_month_generation_{event.lower()} AFTER {event} ON station_logs BEGIN
+                {"".join(_month_generation_sql(row) for row in rows)}
+            END
+        """)
+
+def _seed_month_generations(conn):
+    # Months written before the counters existed, in station_logs and the archives
+    months = f"SELECT DISTINCT {MONTH_SQL.format(row='station_logs')} FROM station_logs WHERE entry_date IS NOT NULL"
+    found = [month for (month,) in conn.execute(months)]
+    for year in _archived_years(conn):
+        with connect(partition_path(year)) as archive:
+            found += [month for (month,) in archive.execute(months)]
+    conn.executemany("INSERT OR IGNORE INTO log_month_generation (month, generation) VALUES (?, 1)",
+                     [(month,) for month in found])
+
+def get_month_generations():
+    # {YYYYMM: change counter} for every month that has (or had) station logs
+    with connect(DB_PATH) as conn:
+        return dict(conn.execute("SELECT month, generation FROM log_month_generation"))
+
+# ----------------- DAILY ROLLUPS -----------------
+# zone_daily_rollup and sps_daily_rollup hold per-day sums of the flow columns plus a
+# row count. Triggers on station_logs apply every insert/update/delete to them inside
+# the writing transaction, so save_station_entry, delete_station_entry and any other
+# writer keep them consistent without extra round trips. sps_daily_rollup is keyed by
+# station_id; readers take the zone and SPS name from the registry (ROLLUP_NAMES).
+# Rows missing a key (an SPS the registry doesn't list yet) stay out until add_station
+# links them.
+ROLLUP_MEASURES = ["pumping_mld", "income_mld", "supply_mld"]
+
+ROLLUP_LEVELS = {
+    "zone": ("zone_daily_rollup", ["entry_date", "zone"]),
+    "sps": ("sps_daily_rollup", ["entry_date", "station_id"]),
+}
+ROLLUP_NAMES = {"zone": [], "sps": ["zone", "sps_name"]}
+
+# Registry names for a row carrying a station_id, joined on the integer key
+STATION_NAMES_SQL = "z.zone_key AS zone, s.name AS sps_name"
+
+def station_join_sql(alias):
+    return f"JOIN stations s ON s.station_id = {alias}.station_id JOIN zones z ON z.zone_id = s.zone_id"
+
+def _rollup_series(level):
+    # Columns identifying one series of the level in what the readers return
+    return ROLLUP_NAMES[level] or ROLLUP_LEVELS[level][1][1:]
+
+def _rollup_keys_present(keys, row):
+    return " AND ".join(f"{row}.{k} IS NOT NULL" for k in keys)
+
+def _rollup_add_sql(table, keys, row, sign):
+    key_values = ", ".join(f"{row}.{k}" for k in keys)
+    measures = ", ".join(f"{sign} coalesce({row}.{m}, 0)" for m in ROLLUP_MEASURES)
+    updates = ", ".join(f"{m} = {m} + excluded.{m}" for m in ROLLUP_MEASURES)
+    return f"""
+        INSERT INTO {table} ({", ".join(keys)}, {", ".join(ROLLUP_MEASURES)}, row_count)
+        SELECT {key_values}, {measures}, {sign}1 WHERE {_rollup_keys_present(keys, row)}
+        ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {updates}, row_count = row_count + excluded.row_count;
+    """
+
+def _rollup_prune_sql(table, keys):
+    where = " AND ".join(f"{k} = old.{k}" for k in keys)
+    return f"DELETE FROM {table} WHERE {where} AND row_count <= 0;"
+
+def _create_rollups(conn):
+    for level, (table, keys) in ROLLUP_LEVELS.items():
+        key_columns = ", ".join(f"{k} {'INTEGER' if k == 'station_id' else 'TEXT'}" for k in keys)
+        measure_columns = ", ".join(f"{m} REAL NOT NULL DEFAULT 0" for m in ROLLUP_MEASURES)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key_columns}, {measure_columns},
+                row_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY ({", ".join(keys)})
+            )
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON station_logs BEGIN
+                {_rollup_add_sql(table, keys, "new", "+")}
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON station_logs BEGIN
+                {_rollup_add_sql(table, keys, "old", "-")}
+                {_rollup_prune_sql(table, keys)}
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_update AFTER UPDATE ON station_logs BEGIN
+                {_rollup_add_sql(table, keys, "old", "-")}
+                {_rollup_prune_sql(table, keys)}
+                {_rollup_add_sql(table, keys, "new", "+")}
+            END
+        """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sps_daily_rollup_station ON sps_daily_rollup (station_id, entry_date)")
+
+def _rollup_select_sql(keys):
+    sums = ", ".join(f"SUM(coalesce({m}, 0))" for m in ROLLUP_MEASURES)
+    return (f"SELECT {', '.join(keys)}, {sums}, COUNT(*) FROM station_logs "
+            f"WHERE {_rollup_keys_present(keys, 'station_logs')} GROUP BY {', '.join(keys)}")
+
+def _rebuild_rollups(conn):
+    # Archived years are added from their partition files, one year at a time
+    archives = [partition_path(year) for year in _archived_years(conn)]
+    for table, keys in ROLLUP_LEVELS.values():
+        columns = f"{', '.join(keys)}, {', '.join(ROLLUP_MEASURES)}, row_count"
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} ({columns}) {_rollup_select_sql(keys)}")
+        for path in archives:
+            with connect(path) as archive:
+                rows = archive.execute(_rollup_select_sql(keys)).fetchall()
+            updates = ", ".join(f"{m} = {m} + excluded.{m}" for m in ROLLUP_MEASURES + ["row_count"])
+            conn.executemany(f"""
+                INSERT INTO {table} ({columns}) VALUES ({", ".join("?" for _ in keys + ROLLUP_MEASURES)}, ?)
+                ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {updates}
+            """, rows)
+
+@perf.timed()
+def rebuild_rollups():
+    with connect(DB_PATH) as conn:
+        _rebuild_rollups(conn)
+
+@perf.timed()
+def check_rollups(tolerance=1e-6):
+    # Compares every rollup row with a fresh GROUP BY over station_logs and returns
+    # the rows that differ (empty DataFrame = consistent).
+    mismatches = []
+    sources = _log_sources()
+    with connect(DB_PATH) as conn:
+        for level, (table, keys) in ROLLUP_LEVELS.items():
+            columns = keys + ROLLUP_MEASURES + ["row_count"]
+            stored = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table}", conn)
+            fresh_rows = []
+            for path in sources:
+                with connect(path) as source:
+                    fresh_rows += source.execute(_rollup_select_sql(keys)).fetchall()
+            fresh = pd.DataFrame(fresh_rows, columns=columns).groupby(keys, as_index=False, dropna=False).sum()
+            merged = stored.merge(fresh, on=keys, how="outer", suffixes=("_rollup", "_raw")).fillna(0)
+            bad = merged["row_count_rollup"] != merged["row_count_raw"]
+            for m in ROLLUP_MEASURES:
+                bad |= (merged[f"{m}_rollup"] - merged[f"{m}_raw"]).abs() > tolerance
+            if bad.any():
+                mismatches.append(merged[bad].assign(level=level))
+    return pd.concat(mismatches, ignore_index=True) if mismatches else pd.DataFrame()
+
+def _rollup_source(table, start_date, end_date, zone=None, sps_name=None):
+    # The table's rows in the range as a subquery; sps_daily_rollup rows come with their
+    # zone and SPS name from the registry
+    filters = ["r.entry_date >= ?", "r.entry_date <= ?"]
+    params = [format_date(start_date), format_date(end_date)]
+    names, join = "", ""
+    if table == ROLLUP_LEVELS["sps"][0]:
+        names, join = f", {STATION_NAMES_SQL}", f" {station_join_sql('r')}"
+    if zone:
+        filters.append("z.zone_key = ?" if join else "r.zone = ?")
+        params.append(zone.strip().lower())
+    if sps_name:
+        filters.append("s.name_key = ?")
+        params.append(normalize_sps_name(sps_name))
+    return f"(SELECT r.*{names} FROM {table} r{join} WHERE {' AND '.join(filters)})", params
+
+# Trend buckets: the first day of the week (Monday) / month each entry falls in
+ROLLUP_GRAINS = {
+    "day": "entry_date",
+    "week": "date(entry_date, '-6 days', 'weekday 1')",
+    "month": "strftime('%Y-%m-01', entry_date)",
+}
+
+@perf.timed()
+def load_daily_rollup(level, start_date, end_date, zone=None, sps_name=None, grain="day"):
+    # Trend series (one row per bucket and zone, or per bucket and SPS). Values are the
+    # daily totals averaged over the days in each bucket, so weekly/monthly series stay
+    # in MLD; row_count and days say how much raw data went into each point.
+    table = ROLLUP_LEVELS["sps" if sps_name else level][0]
+    keys = ROLLUP_LEVELS[level][1]
+    series = ", ".join(_rollup_series(level))
+    source, params = _rollup_source(table, start_date, end_date, zone, sps_name)
+    query = f"""
+        SELECT {ROLLUP_GRAINS[grain]} AS entry_date, {series},
+               {", ".join(f"AVG({m}) AS {m}" for m in ROLLUP_MEASURES)},
+               SUM(row_count) AS row_count, COUNT(*) AS days
+        FROM (
+            SELECT {", ".join(keys + ROLLUP_NAMES[level])}, {", ".join(f"SUM({m}) AS {m}" for m in ROLLUP_MEASURES)},
+                   SUM(row_count) AS row_count
+            FROM {source}
+            GROUP BY {", ".join(keys)}
+        )
+        GROUP BY 1, {", ".join(keys[1:])}
+        ORDER BY 1, {series}
+    """
+    with connect(DB_PATH) as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    df["entry_date"] = pd.to_datetime(df["entry_date"], format="%Y-%m-%d")
+    return df
+
+@perf.timed()
+def load_zone_totals(start_date, end_date, zone=None, sps_name=None):
+    # Totals per zone over a date range, read from the rollups instead of raw rows.
+    table = ROLLUP_LEVELS["sps" if sps_name else "zone"][0]
+    source, params = _rollup_source(table, start_date, end_date, zone, sps_name)
+    query = f"""
+        SELECT zone, {", ".join(f"SUM({m}) AS {m}" for m in ROLLUP_MEASURES)}, SUM(row_count) AS row_count
+        FROM {source}
+        GROUP BY zone ORDER BY zone
+    """
+    with connect(DB_PATH) as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+# ----------------- PERIOD COMPARISON -----------------
+# Current vs previous period totals per zone or SPS in one query: a two-row periods
+# table is joined to the rollups on the indexed date column, so each period is a
+# range scan and only the compact delta table comes back. Per-user comparisons read
+# station_logs (the rollups aren't split by user) through its (username, entry_day) index.
+@perf.timed()
+def load_period_comparison(level, current, previous, zone=None, sps_name=None, username=None):
+    # current/previous: (start_date, end_date). Returns one row per zone (or zone + SPS)
+    # with <measure>_current, _previous, _delta and _pct (NULL when previous is 0).
+    keys = ROLLUP_LEVELS[level][1][1:]
+    series = _rollup_series(level)
+    if username:
+        table, date_column = "station_logs r", "entry_day"
+        bounds = [day_number(d) for period in (current, previous) for d in period]
+        filters, params = [], []
+        for column, value in (("zone", zone.strip().lower() if zone else None), ("sps_name", sps_name),
+                              ("username", username)):
+            if value:
+                filters.append(f"r.{column} = ?")
+                params.append(value)
+        if level == "sps":
+            filters.append("r.station_id IS NOT NULL")      # like the rollups
+    else:
+        source, params = _rollup_source(ROLLUP_LEVELS["sps" if sps_name else level][0],
+                                        min(current[0], previous[0]), max(current[1], previous[1]), zone, sps_name)
+        table, date_column, filters = f"{source} r", "entry_date", []
+        bounds = [format_date(d) for period in (current, previous) for d in period]
+    where = "".join(f" AND {f}" for f in filters)
+    sums = ", ".join(
+        f"SUM(CASE WHEN p.period = 'current' THEN coalesce(r.{m}, 0) ELSE 0 END) AS {m}_current, "
+        f"SUM(CASE WHEN p.period = 'previous' THEN coalesce(r.{m}, 0) ELSE 0 END) AS {m}_previous"
+        for m in ROLLUP_MEASURES
+    )
+    deltas = ", ".join(
+        f"{m}_current, {m}_previous, {m}_current - {m}_previous AS {m}_delta, "
+        f"ROUND(100.0 * ({m}_current - {m}_previous) / NULLIF({m}_previous, 0), 1) AS {m}_pct"
+        for m in ROLLUP_MEASURES
+    )
+    query = f"""
+        WITH periods (period, start_value, end_value) AS (VALUES ('current', ?, ?), ('previous', ?, ?))
+        SELECT {", ".join(series)}, {deltas}
+        FROM (
+            SELECT {", ".join(f"r.{k} AS {k}" for k in keys + ROLLUP_NAMES[level])}, {sums}
+            FROM periods p
+            JOIN {table} ON r.{date_column} BETWEEN p.start_value AND p.end_value{where}
+            GROUP BY {", ".join(f"r.{k}" for k in keys)}
+        )
+        ORDER BY {", ".join(series)}
+    """
+    sources = [DB_PATH]
+    if username:
+        sources = _log_sources(min(current[0], previous[0]), max(current[1], previous[1]))
+    frames = []
+    for path in sources:
+        with connect(path) as conn:
+            frames.append(pd.read_sql_query(query, conn, params=bounds + params))
+    if len(frames) == 1:
+        return frames[0]
+    # Per-user periods reaching into archived years: add up each partition's sums, then
+    # redo the deltas
+    sums = [f"{m}_{period}" for m in ROLLUP_MEASURES for period in ("current", "previous")]
+    frames = [frame for frame in frames if not frame.empty] or frames[-1:]
+    combined = pd.concat(frames, ignore_index=True).groupby(series, as_index=False)[sums].sum()
+    for m in ROLLUP_MEASURES:
+        combined[f"{m}_delta"] = combined[f"{m}_current"] - combined[f"{m}_previous"]
+        previous_sum = combined[f"{m}_previous"].where(combined[f"{m}_previous"] != 0)
+        combined[f"{m}_pct"] = (100.0 * combined[f"{m}_delta"] / previous_sum).round(1)
+    return combined[frames[0].columns]
+
+# ----------------- CRITICAL SPS -----------------
+# A station is critical on a day its entry shows no standby pump. The partial index
+# idx_station_logs_critical_day holds only those entries, so the lookup reads the
+# critical entries in the range rather than the whole range, and returns one row per
+# SPS: its latest critical entry, how many critical days it had, and whether its latest
+# entry in the range is still critical. Stations are grouped and probed by station_id.
+CRITICAL_SQL = "standby_pumps = 0"
+CRITICAL_COLUMNS = ["entry_date", "zone", "sps_name", "total_pumps", "working_pumps", "standby_pumps",
+                    "critical_days", "latest_entry", "still_critical"]
+
+@perf.timed()
+def load_critical_sps(start_date, end_date, zone=None, sps_name=None, username=None):
+    where, params = station_log_filters(zone, start_date, end_date, sps_name, username)
+    where += (" AND " if where else " WHERE ") + CRITICAL_SQL + " AND station_id IS NOT NULL"
+    sources = _log_sources(start_date, end_date)
+    frames = []
+    for path in sources:
+        with connect(path) as conn:
+            # With MAX(), SQLite takes the bare columns from the row holding the latest day
+            frames.append(pd.read_sql_query(f"""
+                SELECT MAX(entry_day) AS entry_date, station_id, zone, sps_name, total_pumps, working_pumps,
+                       standby_pumps, COUNT(*) AS critical_days
+                FROM station_logs INDEXED BY idx_station_logs_critical_day{where}
+                GROUP BY station_id
+            """, conn, params=params))
+    frames = [frame for frame in frames if not frame.empty] or frames[-1:]
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    df = df.sort_values(["entry_date", "sps_name"], ascending=[False, True], kind="stable")
+    critical_days = df.groupby("station_id")["critical_days"].sum()
+    df = df.drop_duplicates("station_id").reset_index(drop=True)
+    df["critical_days"] = critical_days.reindex(df["station_id"]).to_numpy()
+
+    # Latest entry per critical SPS: one (station_id, entry_day) index probe each
+    latest = pd.Series(-1, index=df["station_id"], dtype="int64")
+    if not df.empty:
+        user_filter = " AND username = ?" if username else ""
+        values = ", ".join("(?)" for _ in df["station_id"])
+        for path in sources:
+            with connect(path) as conn:
+                rows = conn.execute(f"""
+                    WITH critical (station_id) AS (VALUES {values})
+                    SELECT c.station_id, (SELECT MAX(entry_day) FROM station_logs l
+                                          WHERE l.station_id = c.station_id AND l.entry_day BETWEEN ? AND ?{user_filter})
+                    FROM critical c
+                """, [*map(int, df["station_id"]), day_number(start_date), day_number(end_date)]
+                    + ([username] if username else [])
+                ).fetchall()
+            for station_id, day in rows:
+                if day is not None:
+                    latest[station_id] = max(latest[station_id], day)
+    df["latest_entry"] = latest.to_numpy()
+    df["still_critical"] = df["latest_entry"] == df["entry_date"]
+    df["entry_date"] = days_to_datetime(df["entry_date"])
+    df["latest_entry"] = days_to_datetime(df["latest_entry"])
+    return df[CRITICAL_COLUMNS]
+
+# ----------------- FLOW ANOMALIES -----------------
+# Flags entries whose pumping/income/supply MLD is far from the station's own recent
+# history: at least FLOW_Z_THRESHOLD standard deviations (and FLOW_MIN_CHANGE of the
+# mean) away from its readings over the previous FLOW_WINDOW_DAYS days, once there are
+# FLOW_MIN_PERIODS of them. flow_stats keeps Welford state (count, mean, sum of squared
+# deviations) per station and measure for the window ending at the latest day written, so
+# saving the next day's entry is scored and folded in with O(1) work. Edits and deletes
+# of earlier days rescore the days whose window they fall in; imports and
+# rebuild_flow_stats rescore with vectorised rolling windows. Flags are stored in
+# flow_anomalies (all of history, like the rollups); pump-count rules are checked on read.
+# Both are keyed by station_id, so entries of an SPS the registry doesn't list yet aren't
+# scored until add_station links them.
+FLOW_MEASURES = ROLLUP_MEASURES
+FLOW_WINDOW_DAYS = 30
+FLOW_MIN_PERIODS = 7
+FLOW_Z_THRESHOLD = 3.5
+FLOW_MIN_CHANGE = 0.1       # fraction of the baseline mean
+FLOW_STD_FLOOR = 0.01       # MLD; a flat history still flags a real change
+
+FLOW_RULES = [
+    ("working_pumps > total_pumps", "Working pumps exceed total pumps"),
+    ("working_pumps + standby_pumps > total_pumps", "Working + standby pumps exceed total pumps"),
+    ("pumping_mld < 0 OR income_mld < 0 OR supply_mld < 0", "Negative flow"),
+]
+FLOW_ANOMALY_COLUMNS = ["entry_date", "zone", "sps_name", "anomaly", "value", "baseline_mean", "baseline_std", "z_score"]
+
+def _create_flow_stats(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS flow_stats (
+            station_id INTEGER,
+            measure TEXT,
+            last_day INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            mean REAL NOT NULL,
+            m2 REAL NOT NULL,
+            PRIMARY KEY (station_id, measure)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS flow_anomalies (
+            entry_day INTEGER,
+            zone TEXT,
+            username TEXT,
+            station_id INTEGER,
+            sps_name TEXT,
+            measure TEXT,
+            value REAL,
+            baseline_mean REAL,
+            baseline_std REAL,
+            z_score REAL,
+            PRIMARY KEY (station_id, entry_day, measure)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_flow_anomalies_day ON flow_anomalies (entry_day)")
+
+def _flow_value(value):
+    # Stored readings as float, with NULL (or NaN from a DataFrame) as None
+    if value is None or value == "":
+        return None
+    value = float(value)
+    return None if value != value else value
+
+def _flow_score(value, n, mean, std):
+    # z-score of value against a baseline, or None when it isn't an anomaly
+    if value is None or n < FLOW_MIN_PERIODS:
+        return None
+    deviation = value - mean
+    if abs(deviation) < FLOW_MIN_CHANGE * abs(mean):
+        return None
+    z_score = deviation / max(std, FLOW_STD_FLOOR)
+    return z_score if abs(z_score) >= FLOW_Z_THRESHOLD else None
+
+def _welford_add(n, mean, m2, value):
+    n += 1
+    delta = value - mean
+    mean += delta / n
+    return n, mean, m2 + delta * (value - mean)
+
+def _welford_remove(n, mean, m2, value):
+    if n <= 1:
+        return 0, 0.0, 0.0
+    n -= 1
+    delta = value - mean
+    mean -= delta / n
+    return n, mean, max(m2 - delta * (value - mean), 0.0)
+
+def _welford_std(n, m2):
+    return (m2 / (n - 1)) ** 0.5 if n > 1 else 0.0
+
+FLOW_ROW_COLUMNS = ["entry_day", "zone", "username", "station_id", "sps_name"] + FLOW_MEASURES
+FLOW_ROW_KEYS = len(FLOW_ROW_COLUMNS) - len(FLOW_MEASURES)      # position of the first measure
+
+def _flow_records(conn, station_ids=None, first_day=None, last_day=None):
+    # station_logs readings (FLOW_ROW_COLUMNS tuples) for the stations and day range: the
+    # hot table through conn (so a write step sees its own transaction), plus any archived
+    # years in the range.
+    filters, params = ["station_id IS NOT NULL"], []
+    if station_ids is not None:
+        filters.append(f"station_id IN ({', '.join('?' for _ in station_ids)})")
+        params += list(station_ids)
+    if first_day is not None:
+        filters.append("entry_day >= ?")
+        params.append(first_day)
+    if last_day is not None:
+        filters.append("entry_day <= ?")
+        params.append(last_day)
+    query = f"SELECT {', '.join(FLOW_ROW_COLUMNS)} FROM station_logs WHERE {' AND '.join(filters)}"
+    years = _archived_years(conn, None if first_day is None else (EPOCH + timedelta(days=first_day)).year,
+                            None if last_day is None else (EPOCH + timedelta(days=last_day)).year)
+    rows = conn.execute(query, params).fetchall()
+    for year in years:
+        with connect(partition_path(year)) as archive:
+            rows += archive.execute(query, params).fetchall()
+    return rows
+
+def _flow_rows(conn, station_ids=None, first_day=None, last_day=None):
+    return pd.DataFrame(_flow_records(conn, station_ids, first_day, last_day), columns=FLOW_ROW_COLUMNS)
+
+def _score_flow_frame(df, first_day=None, last_day=None):
+    # Vectorised scoring: each row's baseline is a time-based rolling window over the
+    # previous FLOW_WINDOW_DAYS days of its station. Returns flow_anomalies rows for the
+    # rows with entry_day in [first_day, last_day].
+    columns = FLOW_ROW_COLUMNS[:FLOW_ROW_KEYS] + ["measure", "value", "baseline_mean", "baseline_std", "z_score"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    df = df.sort_values(["station_id", "entry_day"], kind="stable").reset_index(drop=True)
+    values = df[FLOW_MEASURES].apply(pd.to_numeric, errors="coerce").astype(float)
+    rolling = (values.set_index(days_to_datetime(df["entry_day"]))
+               .groupby(df["station_id"].to_numpy(), sort=True)
+               .rolling(f"{FLOW_WINDOW_DAYS}D", closed="left"))
+    counts, means, stds = rolling.count(), rolling.mean(), rolling.std()
+    in_range = np.ones(len(df), dtype=bool)
+    if first_day is not None:
+        in_range &= df["entry_day"].to_numpy() >= first_day
+    if last_day is not None:
+        in_range &= df["entry_day"].to_numpy() <= last_day
+    flagged = []
+    for measure in FLOW_MEASURES:
+        value = values[measure].to_numpy()
+        n = counts[measure].to_numpy()
+        mean = means[measure].to_numpy()
+        std = stds[measure].fillna(0.0).to_numpy()
+        with np.errstate(invalid="ignore"):
+            deviation = value - mean
+            z_score = deviation / np.maximum(std, FLOW_STD_FLOOR)
+            hit = (in_range & ~np.isnan(value) & (n >= FLOW_MIN_PERIODS)
+                   & (np.abs(deviation) >= FLOW_MIN_CHANGE * np.abs(mean)) & (np.abs(z_score) >= FLOW_Z_THRESHOLD))
+        part = df.loc[hit, FLOW_ROW_COLUMNS[:FLOW_ROW_KEYS]].copy()
+        part["measure"] = measure
+        part["value"] = value[hit]
+        part["baseline_mean"] = mean[hit]
+        part["baseline_std"] = std[hit]
+        part["z_score"] = z_score[hit]
+        flagged.append(part)
+    return pd.concat(flagged, ignore_index=True)[columns]
+
+def _insert_flow_anomalies(conn, flags):
+    # flags: a _score_flow_frame result, or row tuples in the same column order
+    if isinstance(flags, pd.DataFrame):
+        flags = flags.astype(object).where(flags.notna(), None).itertuples(index=False, name=None)
+    conn.executemany("""
+        INSERT OR REPLACE INTO flow_anomalies
+            (entry_day, zone, username, station_id, sps_name, measure, value, baseline_mean, baseline_std, z_score)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, flags)
+
+def _rescore_flow_days(conn, station_id, first_day, last_day):
+    # Rescores one station's entries in [first_day, last_day] from their stored rows. Runs
+    # inside write transactions, so it is one pass in plain Python over at most
+    # 2 × FLOW_WINDOW_DAYS rows, sliding Welford state along them (no pandas).
+    rows = sorted(_flow_records(conn, [station_id], first_day - FLOW_WINDOW_DAYS, last_day))
+    state = {measure: (0, 0.0, 0.0) for measure in FLOW_MEASURES}
+    flags = []
+    oldest = 0      # first row still in the window
+    for row in rows:
+        entry_day = row[0]
+        while rows[oldest][0] < entry_day - FLOW_WINDOW_DAYS:
+            for position, measure in enumerate(FLOW_MEASURES, start=FLOW_ROW_KEYS):
+                if _flow_value(rows[oldest][position]) is not None:
+                    state[measure] = _welford_remove(*state[measure], _flow_value(rows[oldest][position]))
+            oldest += 1
+        for position, measure in enumerate(FLOW_MEASURES, start=FLOW_ROW_KEYS):
+            value = _flow_value(row[position])
+            n, mean, m2 = state[measure]
+            if entry_day >= first_day:
+                std = _welford_std(n, m2)
+                z_score = _flow_score(value, n, mean, std)
+                if z_score is not None:
+                    flags.append((*row[:FLOW_ROW_KEYS], measure, value, mean, std, z_score))
+            if value is not None:
+                state[measure] = _welford_add(n, mean, m2, value)
+    conn.execute("DELETE FROM flow_anomalies WHERE station_id = ? AND entry_day BETWEEN ? AND ?",
+                 (station_id, first_day, last_day))
+    _insert_flow_anomalies(conn, flags)
+
+def _save_flow_state(conn, station_id, last_day, state):
+    conn.executemany("""
+        INSERT INTO flow_stats (station_id, measure, last_day, n, mean, m2) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (station_id, measure) DO UPDATE SET
+            last_day = excluded.last_day, n = excluded.n, mean = excluded.mean, m2 = excluded.m2
+    """, [(station_id, measure, last_day, *state[measure]) for measure in FLOW_MEASURES])
+
+def _update_flow_stats(conn, station_id, entry_day, old, new):
+    # Write hook for one station's station_logs row, called inside the writing transaction
+    # (see _record_flow_change). old/new are the row's {column: value} before and after
+    # the write (None when it didn't exist / was deleted); new also carries zone, username
+    # and sps_name.
+    if old is not None and new is not None and all(
+            _flow_value(old.get(measure)) == _flow_value(new.get(measure)) for measure in FLOW_MEASURES):
+        # Readings unchanged (e.g. a remarks fix): no baseline or score moves
+        conn.execute("UPDATE flow_anomalies SET zone = ?, username = ? WHERE station_id = ? AND entry_day = ?",
+                     (new.get("zone"), new.get("username"), station_id, entry_day))
+        return
+    stored = {measure: (last_day, n, mean, m2) for measure, last_day, n, mean, m2 in conn.execute(
+        "SELECT measure, last_day, n, mean, m2 FROM flow_stats WHERE station_id = ?", (station_id,))}
+    anchor = max((values[0] for values in stored.values()), default=None)
+    state = {measure: stored[measure][1:] if measure in stored else (0, 0.0, 0.0) for measure in FLOW_MEASURES}
+
+    if new is not None and (anchor is None or entry_day > anchor):
+        # A day after every stored one (the daily entry): slide the window to the entry's
+        # baseline, score the entry against it, then fold the entry in.
+        # Days leaving the window: those before the entry's baseline, then (after scoring)
+        # the first day of the baseline. Usually that's one row.
+        leaving = []
+        if anchor is not None and entry_day - FLOW_WINDOW_DAYS > anchor:
+            state = {measure: (0, 0.0, 0.0) for measure in FLOW_MEASURES}
+        elif anchor is not None:
+            leaving = _flow_records(conn, [station_id], anchor - FLOW_WINDOW_DAYS + 1, entry_day - FLOW_WINDOW_DAYS)
+        baseline_start = entry_day - FLOW_WINDOW_DAYS
+        flags = []
+        for position, measure in enumerate(FLOW_MEASURES, start=FLOW_ROW_KEYS):
+            for row in leaving:
+                if row[0] < baseline_start and _flow_value(row[position]) is not None:
+                    state[measure] = _welford_remove(*state[measure], _flow_value(row[position]))
+            value = _flow_value(new.get(measure))
+            n, mean, m2 = state[measure]
+            std = _welford_std(n, m2)
+            z_score = _flow_score(value, n, mean, std)
+            if z_score is not None:
+                flags.append((entry_day, new.get("zone"), new.get("username"), station_id, new.get("sps_name"),
+                              measure, value, mean, std, z_score))
+            if value is not None:
+                state[measure] = _welford_add(n, mean, m2, value)
+            for row in leaving:
+                if row[0] == baseline_start and _flow_value(row[position]) is not None:
+                    state[measure] = _welford_remove(*state[measure], _flow_value(row[position]))
+        conn.execute("DELETE FROM flow_anomalies WHERE station_id = ? AND entry_day = ?", (station_id, entry_day))
+        _insert_flow_anomalies(conn, flags)
+        _save_flow_state(conn, station_id, entry_day, state)
+        return
+
+    # An earlier day changed or an entry was deleted: adjust the window if the day is in
+    # it, and rescore the entries whose baseline includes the day.
+    if anchor is not None and entry_day > anchor - FLOW_WINDOW_DAYS:
+        for measure in FLOW_MEASURES:
+            before = _flow_value(old.get(measure)) if old else None
+            after = _flow_value(new.get(measure)) if new else None
+            if before is not None:
+                state[measure] = _welford_remove(*state[measure], before)
+            if after is not None:
+                state[measure] = _welford_add(*state[measure], after)
+        _save_flow_state(conn, station_id, anchor, state)
+    # Later days can't be archived, so the hot table alone says whether any depend on it
+    later = conn.execute("SELECT 1 FROM station_logs WHERE station_id = ? AND entry_day > ? AND entry_day <= ? LIMIT 1",
+                         (station_id, entry_day, entry_day + FLOW_WINDOW_DAYS)).fetchone()
+    if new is None and later is None:
+        conn.execute("DELETE FROM flow_anomalies WHERE station_id = ? AND entry_day = ?", (station_id, entry_day))
+    else:
+        _rescore_flow_days(conn, station_id, entry_day, entry_day + FLOW_WINDOW_DAYS)
+
+def _record_flow_change(conn, entry_day, old, new):
+    # Passes one row's write to _update_flow_stats for the station(s) it belongs to; old/new
+    # carry the row's station_id. A zone change can move the row to another station.
+    old_station = old["station_id"] if old else None
+    new_station = new["station_id"] if new else None
+    if old_station != new_station:
+        if old_station is not None:
+            _update_flow_stats(conn, old_station, entry_day, old, None)
+        old = None
+    if new_station is not None:
+        _update_flow_stats(conn, new_station, entry_day, old, new)
+
+FLOW_VALUE_COLUMNS = ["station_id"] + FLOW_MEASURES
+
+def _flow_values(conn, entry_date, sps_name):
+    row = conn.execute(f"SELECT {', '.join(FLOW_VALUE_COLUMNS)} FROM station_logs WHERE entry_date = ? AND sps_name = ?",
+                       (entry_date, sps_name)).fetchone()
+    return None if row is None else dict(zip(FLOW_VALUE_COLUMNS, row))
+
+def _rebuild_flow_stats(conn, station_ids=None, first_day=None):
+    # Rescores every entry from first_day on (all of history when None) and recomputes
+    # the window state, for the given stations (all when None).
+    df = _flow_rows(conn, station_ids, None if first_day is None else first_day - FLOW_WINDOW_DAYS)
+    scope, params = ("", []) if station_ids is None else (
+        f" AND station_id IN ({', '.join('?' for _ in station_ids)})", list(station_ids))
+    conn.execute(f"DELETE FROM flow_anomalies WHERE entry_day >= ?{scope}",
+                 [first_day if first_day is not None else -(2 ** 62)] + params)
+    _insert_flow_anomalies(conn, _score_flow_frame(df, first_day))
+    conn.execute(f"DELETE FROM flow_stats WHERE 1{scope}", params)
+    if df.empty:
+        return
+    last_day = df.groupby("station_id")["entry_day"].transform("max")
+    window = df[df["entry_day"] > last_day - FLOW_WINDOW_DAYS]
+    grouped = window[FLOW_MEASURES].apply(pd.to_numeric, errors="coerce").astype(float).groupby(window["station_id"])
+    anchors = window.groupby("station_id")["entry_day"].max()
+    counts, means, variances = grouped.count(), grouped.mean().fillna(0.0), grouped.var(ddof=0).fillna(0.0)
+    conn.executemany(
+        "INSERT INTO flow_stats (station_id, measure, last_day, n, mean, m2) VALUES (?, ?, ?, ?, ?, ?)",
+        [(int(station_id), measure, int(anchors[station_id]), int(counts.at[station_id, measure]),
+          float(means.at[station_id, measure]), float(variances.at[station_id, measure] * counts.at[station_id, measure]))
+         for station_id in anchors.index for measure in FLOW_MEASURES])
+
+@perf.timed()
+def rebuild_flow_stats():
+    with connect(DB_PATH) as conn:
+        _rebuild_flow_stats(conn)
+
+@perf.timed()
+def load_flow_anomalies(start_date, end_date, zone=None, sps_name=None, username=None):
+    # Flow anomalies and pump-count rule violations in the range, newest first
+    where, params = station_log_filters(zone, start_date, end_date, sps_name, username)
+    with connect(DB_PATH) as conn:
+        flows = pd.read_sql_query(f"""
+            SELECT entry_day AS entry_date, zone, sps_name,
+                   measure || CASE WHEN z_score < 0 THEN ' drop' ELSE ' spike' END AS anomaly,
+                   value, baseline_mean, baseline_std, z_score
+            FROM flow_anomalies{where}
+        """, conn, params=params)
+    rule = "CASE " + " ".join(f"WHEN {condition} THEN '{label}'" for condition, label in FLOW_RULES) + " END"
+    rule_where = (where + " AND " if where else " WHERE ") + "(" + " OR ".join(f"({c})" for c, _ in FLOW_RULES) + ")"
+    frames = [flows]
+    for path in _log_sources(start_date, end_date):
+        with connect(path) as conn:
+            frames.append(pd.read_sql_query(f"""
+                SELECT entry_day AS entry_date, zone, sps_name, {rule} AS anomaly FROM station_logs{rule_where}
+            """, conn, params=params))
+    frames = [frame for frame in frames if not frame.empty] or frames[:1]
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    df = df.reindex(columns=FLOW_ANOMALY_COLUMNS)
+    df = df.sort_values(["entry_date", "sps_name", "anomaly"], ascending=[False, True, True], kind="stable")
+    df["entry_date"] = days_to_datetime(df["entry_date"])
+    return df.reset_index(drop=True)
+
+# ----------------- STATION LOGS TABLE -----------------
+STATION_TABLE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS station_logs (
+        entry_date TEXT,
+        zone TEXT,
+        username TEXT,
+        sps_name TEXT,
+        total_pumps INTEGER,
+        working_pumps INTEGER,
+        standby_pumps INTEGER,
+        standby_um INTEGER,
+        remarks TEXT,
+        pumping_mld REAL,
+        income_mld REAL,
+        supply_mld REAL,
+        version INTEGER NOT NULL DEFAULT 1,
+        entry_day INTEGER {ENTRY_DAY_SQL},
+        station_id INTEGER REFERENCES stations (station_id),
+        PRIMARY KEY (entry_date, sps_name)
+    )
+"""
+
+STATION_INDEXES = {
+    "idx_station_logs_day": "entry_day",
+    "idx_station_logs_zone_day": "zone, entry_day",
+    "idx_station_logs_user_day": "username, entry_day",
+    "idx_station_logs_sps_day": "sps_name, entry_day",
+    "idx_station_logs_station_day": "station_id, entry_day",
+    "idx_station_logs_date_sps_key": "entry_date, lower(trim(sps_name))",
+}
+
+# Partial indexes: only the rows matching the condition are indexed
+STATION_PARTIAL_INDEXES = {
+    "idx_station_logs_critical_day": ("entry_day", "standby_pumps = 0"),
+}
+
+def _create_station_indexes(conn):
+    for name, columns in STATION_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON station_logs ({columns})")
+    for name, (columns, condition) in STATION_PARTIAL_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON station_logs ({columns}) WHERE {condition}")
+
+def init_station_db():
+    with connect(DB_PATH) as conn:
+        conn.execute(STATION_TABLE_SQL)
+        _create_registry(conn)
+        _create_partition_registry(conn)
+        _create_month_generations(conn)
+        _create_flow_stats(conn)
+        _migrate_station_db(conn)
+        _create_rollups(conn)
+        _create_data_generation(conn)
+        _create_station_indexes(conn)
         conn.commit()
 
-# ----------------- USER AUTH -----------------
-def register_user(username, password, section, registered_by):
+# ----------------- ARCHIVE PARTITIONS -----------------
+# Years before the hot window are moved out of station_logs into one SQLite file per
+# year (station_data_2021.db next to station_data.db) by rollover_partitions, so the hot
+# table and its indexes only hold recent data. log_partitions lists the archived years;
+# the station_logs readers below open only the files whose years overlap the requested
+# range and union the results. The rollup tables keep covering all of history, so
+# trends and totals never touch an archive. Archived years are read-only: saving,
+# deleting or importing entries in them raises ArchivedEntryError until
+# restore_partition moves the year back into station_logs.
+HOT_YEARS = 2       # the current and previous year stay in station_logs
+
+class ArchivedEntryError(ValueError):
+    pass
+
+def _create_partition_registry(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS log_partitions (
+            year INTEGER PRIMARY KEY,
+            row_count INTEGER NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+    """)
+
+def partition_path(year):
+    root, extension = os.path.splitext(DB_PATH)
+    return f"{root}_{year}{extension or '.db'}"
+
+def _year_of(value):
+    return (EPOCH + timedelta(days=day_number(value))).year
+
+def _year_days(year):
+    return day_number(date(year, 1, 1)), day_number(date(year, 12, 31))
+
+def _archived_years(conn, first_year=None, last_year=None):
+    return [year for (year,) in conn.execute(
+        "SELECT year FROM log_partitions WHERE year BETWEEN ? AND ? ORDER BY year",
+        (first_year if first_year is not None else 0, last_year if last_year is not None else 9999))]
+
+def _log_sources(start_date=None, end_date=None):
+    # Database files holding station_logs rows for the range: archives in year order,
+    # then the hot database.
+    with connect(DB_PATH) as conn:
+        years = _archived_years(conn, _year_of(start_date) if start_date else None,
+                                _year_of(end_date) if end_date else None)
+    paths = [partition_path(year) for year in years]
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Archive partition {path} is missing")
+    return paths + [DB_PATH]
+
+def _check_not_archived(conn, entry_dates):
+    years = {_year_of(value) for value in entry_dates if value}
+    archived = [year for year in sorted(years) if _archived_years(conn, year, year)]
+    if archived:
+        raise ArchivedEntryError(
+            f"Entries for {', '.join(map(str, archived))} are archived and read-only; "
+            f"restore the year with 'python manage.py restore-partition <year>' to change them."
+        )
+
+def _replace_rollup_triggers(conn, event, statement, params):
+    # Runs statement with the rollup triggers for event dropped: moving rows between
+    # partitions doesn't change what the rollups (which cover all history) should hold.
+    # Must run inside a write transaction so no other writer sees the triggers missing.
+    for table, _ in ROLLUP_LEVELS.values():
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{event}")
+    if isinstance(params, list):
+        conn.executemany(statement, params)
+    else:
+        conn.execute(statement, params)
+    _create_rollups(conn)
+
+def list_partitions():
+    with connect(DB_PATH) as conn:
+        return pd.read_sql_query("SELECT year, row_count, archived_at FROM log_partitions ORDER BY year", conn)
+
+@perf.timed()
+def rollover_partitions(hot_years=HOT_YEARS, today=None):
+    # Archives every year before the hot window; returns {year: rows moved}.
+    today = today or date.today()
+    first_hot_year = today.year - hot_years + 1
+    with connect(DB_PATH) as conn:
+        oldest = conn.execute("SELECT MIN(entry_date) FROM station_logs").fetchone()[0]
+    if oldest is None:
+        return {}
+    moved = {}
+    for year in range(_year_of(oldest), first_hot_year):
+        rows = _archive_year(year)
+        if rows:
+            moved[year] = rows
+    return moved
+
+def _archive_year(year):
+    first_day, last_day = _year_days(year)
+    columns = STATION_COLUMNS + ["station_id"]
+    insert = f"INSERT INTO station_logs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    with connect(DB_PATH) as conn:
+        # Holding the write lock keeps entries for the year from being saved while it moves
+        conn.execute("BEGIN IMMEDIATE")
+        if _archived_years(conn, year, year):
+            return 0
+        rows = conn.execute(f"SELECT {', '.join(columns)} FROM station_logs WHERE entry_day BETWEEN ? AND ?",
+                            (first_day, last_day)).fetchall()
+        if not rows:
+            return 0
+        # The archive is written (from scratch) and committed first; if anything fails
+        # before the hot rows are deleted, the year stays unregistered and is redone.
+        with connect(partition_path(year)) as archive:
+            archive.execute(STATION_TABLE_SQL)
+            archive.execute("DELETE FROM station_logs")
+            archive.executemany(insert, rows)
+            _create_station_indexes(archive)
+        _replace_rollup_triggers(conn, "delete", "DELETE FROM station_logs WHERE entry_day BETWEEN ? AND ?",
+                                 (first_day, last_day))
+        conn.execute("INSERT INTO log_partitions (year, row_count, archived_at) VALUES (?, ?, ?)",
+                     (year, len(rows), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return len(rows)
+
+@perf.timed()
+def restore_partition(year):
+    # Moves an archived year back into station_logs; returns the number of rows restored.
+    # The archive file is emptied rather than deleted, so connections other threads
+    # still hold to it stay valid for a later rollover.
+    columns = STATION_COLUMNS + ["station_id"]
+    path = partition_path(year)
+    with connect(DB_PATH) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if not _archived_years(conn, year, year):
+            raise ValueError(f"{year} is not archived")
+        with connect(path) as archive:
+            rows = archive.execute(f"SELECT {', '.join(columns)} FROM station_logs").fetchall()
+        _replace_rollup_triggers(
+            conn, "insert",
+            f"INSERT INTO station_logs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})", rows)
+        conn.execute("DELETE FROM log_partitions WHERE year = ?", (year,))
+    with connect(path) as archive:
+        archive.execute("DELETE FROM station_logs")
+    return len(rows)
+
+# ----------------- USER DIRECTORY -----------------
+# The users table is small and read on every login, so each process keeps it in memory
+# keyed by username; lookups are served from memory without touching the database.
+# users_generation is bumped by triggers on every change to users. A login compares it
+# with the generation the directory was loaded at and reloads on a mismatch, so a
+# registration, password reset or section change from another process is seen at the
+# next login (the old password stops working); this process's own writes invalidate it.
+class AuthContext(NamedTuple):
+    username: str
+    section: str
+
+    @property
+    def can_log_entry(self):
+        return self.section in ("log entry", "both")
+
+    @property
+    def can_analyze(self):
+        return self.section in ("analysis report", "both")
+
+    @property
+    def is_admin(self):
+        return self.username == "admin"
+
+_user_directory = {}        # abspath -> (users generation, {username: users row})
+_user_directory_lock = threading.Lock()
+
+def _create_users_generation(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO users_generation (id, generation) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_users_generation_{event.lower()} AFTER {event} ON users BEGIN
+                UPDATE users_generation SET generation = generation + 1 WHERE id = 1;
+            END
+        """)
+
+def _users_generation(conn):
+    row = conn.execute("SELECT generation FROM users_generation WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+@perf.timed()
+def _load_users():
+    with connect(USER_DB_PATH) as conn:
+        # Generation first: a write between the two reads only causes another reload
+        generation = _users_generation(conn)
+        rows = conn.execute("SELECT * FROM users").fetchall()      # positional, like authenticate_user always was
+    directory = {row[0]: tuple(row) for row in rows}
+    with _user_directory_lock:
+        _user_directory[os.path.abspath(USER_DB_PATH)] = (generation, directory)
+    return directory
+
+def preload_users(reload=False):
+    # Returns this process's user directory, loading it when missing or reload is set
+    with _user_directory_lock:
+        cached = _user_directory.get(os.path.abspath(USER_DB_PATH))
+    if cached is None or reload:
+        return _load_users()
+    return cached[1]
+
+def _current_users():
+    # Like preload_users, but also reloads when another process changed users since
+    with _user_directory_lock:
+        cached = _user_directory.get(os.path.abspath(USER_DB_PATH))
+    if cached is not None:
+        with connect(USER_DB_PATH) as conn:
+            if _users_generation(conn) == cached[0]:
+                return cached[1]
+    return _load_users()
+
+def _lookup_user(username):
+    return preload_users().get(username)
+
+def invalidate_user_directory():
+    with _user_directory_lock:
+        _user_directory.pop(os.path.abspath(USER_DB_PATH), None)
+
+def insert_user(conn, username, password, section, registered_by):
+    # Write step of register_user on an open connection (no commit); see write_queue.py
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with sqlite3.connect(USER_DB_PATH) as conn:
-        conn.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?)",
-                     (username, password, section, registered_by, timestamp))
+    conn.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?)",
+                 (username, password, section, registered_by, timestamp))
+
+@perf.timed()
+def register_user(username, password, section, registered_by):
+    with connect(USER_DB_PATH) as conn:
+        insert_user(conn, username, password, section, registered_by)
         conn.commit()
+    invalidate_user_directory()
+
+@perf.timed()
+def reset_password(username, password):
+    # Returns False when the user doesn't exist
+    with connect(USER_DB_PATH) as conn:
+        updated = conn.execute("UPDATE users SET password = ? WHERE username = ?", (password, username)).rowcount
+        conn.commit()
+    invalidate_user_directory()
+    return updated > 0
 
 def authenticate_user(username, password):
-    with sqlite3.connect(USER_DB_PATH) as conn:
-        cursor = conn.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
-        return cursor.fetchone()
+    user = _current_users().get(username)
+    if user is None or user[1] != password:
+        return None
+    return user
+
+def auth_context(username):
+    # AuthContext for a known user, or None
+    user = _lookup_user(username)
+    return AuthContext(user[0], user[2]) if user else None
 
 def get_user_section(username):
-    with sqlite3.connect(USER_DB_PATH) as conn:
-        cursor = conn.execute("SELECT section FROM users WHERE username = ?", (username,))
-        result = cursor.fetchone()
-        return result[0] if result else None
+    user = _lookup_user(username)
+    return user[2] if user else None
 
+@perf.timed()
 def get_all_users():
-    with sqlite3.connect(USER_DB_PATH) as conn:
+    with connect(USER_DB_PATH) as conn:
         return pd.read_sql_query("SELECT * FROM users", conn)
 
 # ----------------- STATION LOGGING -----------------
+# Write modes for save_station_entry:
+#   SAVE_INSERT    - only create the entry; an existing (entry_date, sps_name) row is left alone
+#   SAVE_OVERWRITE - create or replace the entry (what a PIN-unlocked edit used to do)
+SAVE_INSERT = "insert"
+SAVE_OVERWRITE = "overwrite"
 
+STATION_FIELDS = [
+    "entry_date", "zone", "username", "sps_name", "total_pumps",
+    "working_pumps", "standby_pumps", "standby_um", "remarks",
+    "pumping_mld", "income_mld", "supply_mld",
+]
+STATION_COLUMNS = STATION_FIELDS + ["version"]
 
-def save_station_entry(data, pin_entered):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        existing = cursor.execute("SELECT * FROM station_logs WHERE entry_date = ? AND sps_name = ?",
-                                  (data['entry_date'], data['sps_name'])).fetchone()
-        if existing:
-            if pin_entered:
-                cursor.execute("""
-                    UPDATE station_logs SET
-                        zone = ?, username = ?, total_pumps = ?, working_pumps = ?,
-                        standby_pumps = ?, standby_um = ?, remarks = ?,
-                        pumping_mld = ?, income_mld = ?, supply_mld = ?
-                    WHERE entry_date = ? AND sps_name = ?
-                """, (
-                    data['zone'], data['username'], data['total_pumps'], data['working_pumps'],
-                    data['standby_pumps'], data['standby_um'], data['remarks'],
-                    data['pumping_mld'], data['income_mld'], data['supply_mld'],
-                    data['entry_date'], data['sps_name']
-                ))
-        else:
-            cursor.execute("""
-                INSERT INTO station_logs (
-                    entry_date, zone, username, sps_name, total_pumps,
-                    working_pumps, standby_pumps, standby_um, remarks,
-                    pumping_mld, income_mld, supply_mld
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                data['entry_date'], data['zone'], data['username'], data['sps_name'], data['total_pumps'],
-                data['working_pumps'], data['standby_pumps'], data['standby_um'], data['remarks'],
-                data['pumping_mld'], data['income_mld'], data['supply_mld']
-            ))
-        conn.commit()
+OVERWRITE_SET_SQL = """
+        zone = excluded.zone, username = excluded.username,
+        total_pumps = excluded.total_pumps, working_pumps = excluded.working_pumps,
+        standby_pumps = excluded.standby_pumps, standby_um = excluded.standby_um,
+        remarks = excluded.remarks, pumping_mld = excluded.pumping_mld,
+        income_mld = excluded.income_mld, supply_mld = excluded.supply_mld,
+        station_id = excluded.station_id, version = station_logs.version + 1
+"""
+
+# Resolves the registry id for a (zone, sps_name) pair inside INSERT statements
+def station_id_sql(zone, sps_name):
+    return f"""(SELECT s.station_id FROM stations s JOIN zones z ON z.zone_id = s.zone_id
+                WHERE z.zone_key = {zone} AND s.name_key = lower(trim({sps_name})))"""
+
+UPSERT_STATION_SQL = f"""
+    INSERT INTO station_logs (
+        entry_date, zone, username, sps_name, total_pumps,
+        working_pumps, standby_pumps, standby_um, remarks,
+        pumping_mld, income_mld, supply_mld, version, station_id
+    ) VALUES (
+        :entry_date, :zone, :username, :sps_name, :total_pumps,
+        :working_pumps, :standby_pumps, :standby_um, :remarks,
+        :pumping_mld, :income_mld, :supply_mld, 1, {station_id_sql(":zone", ":sps_name")}
+    )
+    ON CONFLICT (entry_date, sps_name) DO UPDATE SET {OVERWRITE_SET_SQL}
+    WHERE :overwrite
+      AND (:expected_version IS NULL OR station_logs.version = :expected_version)
+    RETURNING version, station_id
+"""
+
+def _station_params(data, mode, expected_version):
+    params = {field: data.get(field) for field in STATION_FIELDS}
+    params["zone"] = str(params["zone"] or "").strip().lower()
+    params["overwrite"] = 1 if mode == SAVE_OVERWRITE else 0
+    params["expected_version"] = expected_version
+    return params
+
+def check_save_mode(mode):
+    if mode not in (SAVE_INSERT, SAVE_OVERWRITE):
+        raise ValueError(f"Unknown save mode: {mode}")
+
+def write_station_entry(conn, data, mode=SAVE_INSERT, expected_version=None):
+    # Write step of save_station_entry on an open connection (no commit); see write_queue.py
+    _check_not_archived(conn, [data.get("entry_date")])
+    params = _station_params(data, mode, expected_version)
+    old = _flow_values(conn, params["entry_date"], params["sps_name"])
+    row = conn.execute(UPSERT_STATION_SQL, params).fetchone()
+    if row:
+        _record_flow_change(conn, day_number(params["entry_date"]), old, dict(params, station_id=row[1]))
+    return row[0] if row else None
+
+@perf.timed()
+def save_station_entry(data, mode=SAVE_INSERT, expected_version=None):
+    # Single-statement upsert. Returns the row's new version, or None when nothing was
+    # written: the entry already exists in SAVE_INSERT mode, or somebody else changed
+    # it since expected_version was read (optimistic concurrency check).
+    check_save_mode(mode)
+    with connect(DB_PATH) as conn:
+        # Take the write lock first, so the archive check and the old flow values are
+        # read in the same transaction as the UPSERT rather than in autocommit before it
+        conn.execute("BEGIN IMMEDIATE")
+        return write_station_entry(conn, data, mode, expected_version)
+
+# ----------------- BULK IMPORT -----------------
+# Conflict policies for import_station_entries when (entry_date, sps_name) already exists:
+#   IMPORT_SKIP      - keep the stored entry, import the rest
+#   IMPORT_OVERWRITE - replace the stored entry (version is bumped)
+#   IMPORT_REPORT    - import nothing if any row conflicts; return the conflicting keys
+IMPORT_SKIP = "skip"
+IMPORT_OVERWRITE = "overwrite"
+IMPORT_REPORT = "report"
+
+IMPORT_BATCH_SIZE = 5000
+
+IMPORT_STATIONS_SQL = """
+    SELECT DISTINCT l.station_id FROM temp.import_staging s
+    JOIN station_logs l ON l.entry_date = s.entry_date AND l.sps_name = s.sps_name
+    WHERE l.station_id IS NOT NULL
+"""
+
+def _stage_rows(conn, rows, progress, batch_size):
+    insert = (f"INSERT INTO temp.import_staging ({', '.join(STATION_FIELDS)}) "
+              f"VALUES ({', '.join('?' for _ in STATION_FIELDS)})")
+    staged = 0
+    batch = []
+    for row in rows:
+        batch.append(tuple(row.get(field) for field in STATION_FIELDS))
+        if len(batch) >= batch_size:
+            conn.executemany(insert, batch)
+            staged += len(batch)
+            batch = []
+            if progress:
+                progress(staged)
+    if batch:
+        conn.executemany(insert, batch)
+        staged += len(batch)
+    if progress:
+        progress(staged)
+    return staged
+
+@perf.timed()
+def import_station_entries(rows, policy=IMPORT_SKIP, progress=None, batch_size=IMPORT_BATCH_SIZE):
+    # Streams already-validated row dicts (see bulk_import.py) into a temp staging table
+    # with executemany, then moves them into station_logs with one set-based statement,
+    # all inside a single transaction. progress(rows_staged) is called after each batch.
+    if policy not in (IMPORT_SKIP, IMPORT_OVERWRITE, IMPORT_REPORT):
+        raise ValueError(f"Unknown import policy: {policy}")
+    columns = ", ".join(STATION_FIELDS)
+    result = {"staged": 0, "inserted": 0, "updated": 0, "skipped": 0, "conflicts": []}
+
+    with connect(DB_PATH) as conn:
+        conn.execute("DROP TABLE IF EXISTS temp.import_staging")
+        conn.execute(f"CREATE TEMP TABLE import_staging AS SELECT {', '.join(STATION_COLUMNS)} FROM station_logs WHERE 0")
+        try:
+            result["staged"] = _stage_rows(conn, rows, progress, batch_size)
+            conn.execute("UPDATE temp.import_staging SET zone = lower(trim(zone))")
+            _check_not_archived(conn, [row[0] for row in conn.execute(
+                "SELECT MIN(entry_date) FROM temp.import_staging GROUP BY substr(entry_date, 1, 4)")])
+
+            new_keys = conn.execute("""
+                SELECT COUNT(*) FROM (SELECT DISTINCT entry_date, sps_name FROM temp.import_staging) s
+                WHERE NOT EXISTS (SELECT 1 FROM station_logs l
+                                  WHERE l.entry_date = s.entry_date AND l.sps_name = s.sps_name)
+            """).fetchone()[0]
+
+            if policy == IMPORT_REPORT:
+                result["conflicts"] = conn.execute("""
+                    SELECT s.entry_date, s.sps_name, 'exists' FROM temp.import_staging s
+                    JOIN station_logs l ON l.entry_date = s.entry_date AND l.sps_name = s.sps_name
+                    UNION ALL
+                    SELECT entry_date, sps_name, 'duplicate in file' FROM temp.import_staging
+                    GROUP BY entry_date, sps_name HAVING COUNT(*) > 1
+                    ORDER BY 1, 2
+                """).fetchall()
+                if result["conflicts"]:
+                    conn.rollback()
+                    return result
+
+            # Stations whose flow statistics the import touches: those of the stored rows it
+            # may overwrite (a changed zone moves a row to another station) and of every
+            # row afterwards
+            stations = {station_id for (station_id,) in conn.execute(IMPORT_STATIONS_SQL)}
+            if policy == IMPORT_OVERWRITE:
+                conn.execute(f"""
+                    INSERT INTO station_logs ({columns}, station_id)
+                    SELECT {columns}, {station_id_sql("zone", "sps_name")}
+                    FROM temp.import_staging WHERE true ORDER BY rowid
+                    ON CONFLICT (entry_date, sps_name) DO UPDATE SET {OVERWRITE_SET_SQL}
+                """)
+            else:
+                conn.execute(f"""
+                    INSERT INTO station_logs ({columns}, station_id)
+                    SELECT {columns}, {station_id_sql("zone", "sps_name")}
+                    FROM temp.import_staging WHERE true ORDER BY rowid
+                    ON CONFLICT (entry_date, sps_name) DO NOTHING
+                """)
+            # changes() counts rows written by the statement itself, not by the rollup triggers
+            written = conn.execute("SELECT changes()").fetchone()[0]
+            stations |= {station_id for (station_id,) in conn.execute(IMPORT_STATIONS_SQL)}
+            first_date = conn.execute("SELECT MIN(entry_date) FROM temp.import_staging").fetchone()[0]
+            if first_date and stations:
+                _rebuild_flow_stats(conn, sorted(stations), day_number(first_date))
+            result["inserted"] = new_keys
+            result["updated"] = written - new_keys
+            result["skipped"] = result["staged"] - written
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.import_staging")
+    return result
+
+# ----------------- ENTRY LOOKUP -----------------
+# Duplicate checks compare SPS names case- and whitespace-insensitively, matching the
+# expression index idx_station_logs_date_sps_key, so a lookup is a single index probe.
+ENTRY_KEY_SQL = "entry_date = ? AND lower(trim(sps_name)) = ?"
+
+def normalize_sps_name(sps_name):
+    return str(sps_name).strip().lower()
+
+def _find_entry(columns, entry_date, sps_name):
+    # Probes the hot table, then the archive of the entry's year if that year is archived.
+    # Returns (column names, row) or None.
+    query = f"SELECT {columns} FROM station_logs WHERE {ENTRY_KEY_SQL} LIMIT 1"
+    params = (format_date(entry_date), normalize_sps_name(sps_name))
+    with connect(DB_PATH) as conn:
+        cursor = conn.execute(query, params)
+        row = cursor.fetchone()
+        year = _year_of(entry_date)
+        if row is None and _archived_years(conn, year, year):
+            with connect(partition_path(year)) as archive:
+                cursor = archive.execute(query, params)
+                row = cursor.fetchone()
+        return None if row is None else ([col[0] for col in cursor.description], row)
+
+@perf.timed()
+def get_entry(entry_date, sps_name):
+    found = _find_entry(", ".join(STATION_COLUMNS), entry_date, sps_name)
+    return dict(zip(*found)) if found else None
 
+@perf.timed()
+def entry_exists(entry_date, sps_name):
+    return _find_entry("1", entry_date, sps_name) is not None
+
+def remove_station_entry(conn, entry_date, sps_name):
+    # Write step of delete_station_entry on an open connection (no commit); see write_queue.py
+    _check_not_archived(conn, [entry_date])
+    _delete_entry(conn, entry_date, sps_name)
+
+def _delete_entry(conn, entry_date, sps_name):
+    row = conn.execute(f"DELETE FROM station_logs WHERE entry_date = ? AND sps_name = ? RETURNING {', '.join(FLOW_VALUE_COLUMNS)}",
+                       (entry_date, sps_name)).fetchone()
+    if row:
+        _record_flow_change(conn, day_number(entry_date), dict(zip(FLOW_VALUE_COLUMNS, row)), None)
+
+@perf.timed()
 def delete_station_entry(entry_date, sps_name):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("DELETE FROM station_logs WHERE entry_date = ? AND sps_name = ?", (entry_date, sps_name))
+    with connect(DB_PATH) as conn:
+        conn.execute("BEGIN IMMEDIATE")     # see save_station_entry
+        remove_station_entry(conn, entry_date, sps_name)
         conn.commit()
-# ✅ Correct Function Definition
-def load_station_logs(zone=None, start_date=None, end_date=None):
-    conn = sqlite3.connect(DB_PATH)
-    query = "SELECT * FROM station_logs"
+# ----------------- ENTRY PAGES AND BATCH CHANGES -----------------
+# The Recent Entries view reads one page at a time, newest first, with keyset
+# pagination on (entry_day DESC, sps_name) through the (zone, entry_day) index, and
+# applies a page's edits and deletes in one transaction.
+class StaleEntriesError(ValueError):
+    def __init__(self, keys):
+        self.keys = keys
+        super().__init__(f"{len(keys)} of the edited entries were changed or deleted by someone else; "
+                         f"nothing was saved. Reload the page and try again.")
+
+@perf.timed()
+def load_entry_page(zone=None, start_date=None, end_date=None, sps_name=None, username=None, after=None, limit=50):
+    # after: (entry_date, sps_name) of the previous page's last row, or None for the
+    # first page. Partitions are read newest first until the page is full.
+    where, params = station_log_filters(zone, start_date, end_date, sps_name, username)
+    if after is not None:
+        after_day = day_number(after[0])
+        where += (" AND " if where else " WHERE ") + "(entry_day < ? OR (entry_day = ? AND sps_name > ?))"
+        params = params + [after_day, after_day, after[1]]
+    columns = ", ".join("entry_day AS entry_date" if c == "entry_date" else c for c in STATION_COLUMNS)
+    frames = []
+    remaining = limit
+    for path in reversed(_log_sources(start_date, end_date)):
+        with connect(path) as conn:
+            frame = pd.read_sql_query(f"SELECT {columns} FROM station_logs{where} "
+                                      f"ORDER BY entry_day DESC, sps_name LIMIT ?", conn, params=params + [remaining])
+        frames.append(frame)
+        remaining -= len(frame)
+        if remaining <= 0:
+            break
+    frames = [frame for frame in frames if not frame.empty] or frames[:1]
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    df["entry_date"] = days_to_datetime(df["entry_date"])
+    return df
+
+def write_entry_batch(conn, updates=(), deletes=()):
+    # Write step of apply_entry_batch on an open connection (no commit); see write_queue.py.
+    # updates: (entry dict, version it was read at) pairs, saved in SAVE_OVERWRITE mode;
+    # deletes: (entry_date, sps_name) pairs. Raises StaleEntriesError after writing when
+    # an update lost the optimistic check, so the caller's rollback discards the batch.
+    updates, deletes = list(updates), list(deletes)
+    _check_not_archived(conn, [data.get("entry_date") for data, _ in updates] + [key[0] for key in deletes])
+    stale = []
+    for data, version in updates:
+        # A row deleted since it was read comes back as a fresh insert (version 1)
+        if write_station_entry(conn, data, SAVE_OVERWRITE, version) != version + 1:
+            stale.append((data.get("entry_date"), data.get("sps_name")))
+    for entry_date, sps_name in deletes:
+        _delete_entry(conn, entry_date, sps_name)
+    if stale:
+        raise StaleEntriesError(stale)
+    return {"updated": len(updates), "deleted": len(deletes)}
+
+@perf.timed()
+def apply_entry_batch(updates=(), deletes=()):
+    # All of the updates and deletes, or none of them; returns {"updated": n, "deleted": n}
+    with connect(DB_PATH) as conn:
+        conn.execute("BEGIN IMMEDIATE")     # see save_station_entry
+        return write_entry_batch(conn, updates, deletes)
+
+def format_date(value):
+    if value is None:
+        return None
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d")
+    return str(value)
+
+def station_log_filters(zone=None, start_date=None, end_date=None, sps_name=None, username=None):
+    # Returns (" WHERE ...", params) for the station_logs filter arguments, or ("", []).
     filters = []
     params = []
 
     if zone:
-        filters.append("Zone = ?")
-        params.append(zone)
+        filters.append("zone = ?")
+        params.append(zone.strip().lower())
 
-    if start_date and end_date:
-        filters.append("Date BETWEEN ? AND ?")
-        params.extend([start_date, end_date])
+    if sps_name:
+        filters.append("sps_name = ?")
+        params.append(sps_name)
 
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
+    if username:
+        filters.append("username = ?")
+        params.append(username)
 
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    return df
-def get_zone_sps_mapping():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    if start_date:
+        filters.append("entry_day >= ?")
+        params.append(day_number(start_date))
+
+    if end_date:
+        filters.append("entry_day <= ?")
+        params.append(day_number(end_date))
+
+    if not filters:
+        return "", params
+    return " WHERE " + " AND ".join(filters), params
 
-    try:
-        cursor.execute("SELECT Zone, [SPS Name] FROM station_logs")
-        rows = cursor.fetchall()
-        zone_sps_map = {}
+# ✅ Correct Function Definition
+@perf.timed()
+def load_station_logs(zone=None, start_date=None, end_date=None, sps_name=None, username=None):
+    # entry_date comes back as datetime64, built from the integer day number
+    where, params = station_log_filters(zone, start_date, end_date, sps_name, username)
+    columns = ", ".join("entry_day AS entry_date" if c == "entry_date" else c for c in STATION_COLUMNS + ["station_id"])
+    frames = []
+    for path in _log_sources(start_date, end_date):
+        with connect(path) as conn:
+            frames.append(pd.read_sql_query(f"SELECT {columns} FROM station_logs" + where, conn, params=params))
+    frames = [frame for frame in frames if not frame.empty] or frames[-1:]
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    df["entry_date"] = days_to_datetime(df["entry_date"])
+    return df
 
-        for zone, sps in rows:
-            if zone not in zone_sps_map:
-                zone_sps_map[zone] = set()
-            zone_sps_map[zone].add(sps)
+@perf.timed()
+def count_station_logs(zone=None, start_date=None, end_date=None, sps_name=None, username=None):
+    where, params = station_log_filters(zone, start_date, end_date, sps_name, username)
+    total = 0
+    for path in _log_sources(start_date, end_date):
+        with connect(path) as conn:
+            total += conn.execute("SELECT COUNT(*) FROM station_logs" + where, params).fetchone()[0]
+    return total
 
-        # Convert sets to sorted lists
-        zone_sps_map = {zone: sorted(list(sps_set)) for zone, sps_set in zone_sps_map.items()}
+def iter_station_logs(chunk_size=5000, zone=None, start_date=None, end_date=None, sps_name=None, username=None):
+    # Streams matching rows in entry_date order (archives first, then the hot table) as
+    # lists of tuples; the first item yielded is the list of column names.
+    where, params = station_log_filters(zone, start_date, end_date, sps_name, username)
+    yield list(STATION_COLUMNS)
+    for path in _log_sources(start_date, end_date):
+        with connect(path) as conn:
+            cursor = conn.execute(f"SELECT {', '.join(STATION_COLUMNS)} FROM station_logs" + where +
+                                  " ORDER BY entry_day, sps_name", params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
 
-        return zone_sps_map
+# ----------------- ENTRY COMPLETENESS -----------------
+@perf.timed()
+def load_completeness(stations, start_date, end_date):
+    # stations: iterable of (zone, sps_name). Returns one row per station and day in
+    # the range with entered = 1/0, computed in SQL: a generated calendar crossed with
+    # the station list and probed against station_logs through the
+    # (entry_date, lower(trim(sps_name))) index.
+    stations = list(stations)
+    columns = ["zone", "sps_name", "entry_date", "entered"]
+    if not stations:
+        return pd.DataFrame(columns=columns)
+    values = ", ".join(f"({position}, ?, ?, ?)" for position in range(len(stations)))
+    params = [format_date(start_date), format_date(end_date)]
+    for zone, sps_name in stations:
+        params.extend([zone.strip().lower(), sps_name, normalize_sps_name(sps_name)])
+    query = f"""
+        WITH RECURSIVE days(entry_date) AS (
+            SELECT date(?1) UNION ALL
+            SELECT date(entry_date, '+1 day') FROM days WHERE entry_date < date(?2)
+        ),
+        stations(position, zone, sps_name, sps_key) AS (VALUES {values})
+        SELECT s.zone, s.sps_name, d.entry_date,
+               EXISTS (SELECT 1 FROM station_logs l
+                       WHERE l.entry_date = d.entry_date AND lower(trim(l.sps_name)) = s.sps_key) AS entered
+        FROM stations s CROSS JOIN days d
+        ORDER BY s.position, d.entry_date
+    """
+    frames = []
+    for path in _log_sources(start_date, end_date):
+        with connect(path) as conn:
+            frames.append(pd.DataFrame(conn.execute(query, params).fetchall(), columns=columns))
+    if len(frames) == 1:
+        return frames[0]
+    # Same station × day order in every frame; a day counts as entered in any partition
+    grid = frames[0]
+    grid["entered"] = pd.concat([frame["entered"] for frame in frames], axis=1).max(axis=1)
+    return grid
 
-    except Exception as e:
-        print("Error in get_zone_sps_mapping:", e)
-        return None
-    finally:
-        conn.close()
+@perf.timed()
+def get_date_bounds(username=None):
+    # Separate MIN/MAX subqueries so each is a single probe of a day-number index,
+    # taken over every partition
+    where = " WHERE username = ?" if username else ""
+    params = (username, username) if username else ()
+    bounds = []
+    for path in _log_sources():
+        with connect(path) as conn:
+            bounds.append(conn.execute(f"""
+                SELECT date((SELECT MIN(entry_day) FROM station_logs{where}) * 86400, 'unixepoch'),
+                       date((SELECT MAX(entry_day) FROM station_logs{where}) * 86400, 'unixepoch')
+            """, params).fetchone())
+    firsts = [first for first, _ in bounds if first]
+    lasts = [last for _, last in bounds if last]
+    return (min(firsts) if firsts else None, max(lasts) if lasts else None)
 
+def get_zone_sps_mapping():
+    # {zone code: [SPS names]} in display order, served from the cached registry
+    registry = get_station_registry()
+    return {code: group["sps_name"].tolist() for code, group in registry.groupby("zone_code", sort=False)}
 
+def get_zone_groups():
+    # {zone_group: set of lower-case zone keys}, e.g. {"tsps": {"tsps"}, ...}
+    registry = get_station_registry()
+    return {group: set(zones["zone"]) for group, zones in registry.groupby("zone_group", sort=False)}
 
 
 # ✅ Backward-compatible alias
@@ -0,0 +1,67 @@
+import os
+import tempfile
+
+import xlsxwriter
+
+import snapshot
+
+# ----------------- STREAMING EXCEL EXPORTS -----------------
+# Workbooks are written with xlsxwriter's constant_memory mode, which flushes each row
+# to disk as soon as the next one starts, from rows read in chunks from the columnar
+# snapshot (snapshot.py). Peak memory is one chunk of rows regardless of how many
+# years are exported.
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CHUNK_SIZE = 5000
+
+
+def write_xlsx(path, columns, row_chunks, sheet_name="Log Data", progress=None):
+    # progress(rows_written) is called after each chunk
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "default_date_format": "yyyy-mm-dd"})
+    try:
+        sheet = workbook.add_worksheet(sheet_name)
+        header = workbook.add_format({"bold": True})
+        sheet.write_row(0, 0, columns, header)
+        row_number = 0
+        for chunk in row_chunks:
+            for row in chunk:
+                row_number += 1
+                sheet.write_row(row_number, 0, row)
+            if progress:
+                progress(row_number)
+    finally:
+        workbook.close()
+    return row_number
+
+
+def dataframe_chunks(df, chunk_size=CHUNK_SIZE):
+    # Adapts an in-memory DataFrame (e.g. an already-filtered table) to write_xlsx.
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        yield [tuple("" if value != value else value for value in row)
+               for row in chunk.astype(object).itertuples(index=False, name=None)]
+
+
+def _to_bytes(write):
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        write(path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def export_station_logs(path, chunk_size=CHUNK_SIZE, progress=None, **filters):
+    # Writes station_logs rows matching the load_station_logs filters to an .xlsx file.
+    chunks = snapshot.iter_station_logs(chunk_size=chunk_size, **filters)
+    columns = next(chunks)
+    return write_xlsx(path, columns, chunks, progress=progress)
+
+
+def station_logs_xlsx(**filters):
+    return _to_bytes(lambda path: export_station_logs(path, **filters))
+
+
+def dataframe_xlsx(df, sheet_name="Log Data"):
+    return _to_bytes(lambda path: write_xlsx(path, [str(c) for c in df.columns], dataframe_chunks(df), sheet_name))
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import database
+import exports
+import reports
+
+# ----------------- BACKGROUND JOBS -----------------
+# Heavy exports and reports run in a small pool of worker processes instead of the
+# Streamlit script, so the requesting page (and everyone else's data entry) stays
+# responsive. Jobs live in a table in app_data.db: the UI polls it for status and
+# progress, workers write progress into it. A job is identified by its kind, params
+# and the data generation, so identical requests share one job and its result file.
+# Result files are kept in JOB_RESULT_DIR for JOB_RESULT_TTL seconds.
+#
+# Each job records the host and pid of the server process whose pool runs it. Several
+# Streamlit processes may share app_data.db, so a job is only failed as interrupted
+# once that owner process is gone, never because another process started.
+JOB_WORKERS = 2
+JOB_RESULT_DIR = "job_results"
+JOB_RESULT_TTL = 6 * 60 * 60
+PROGRESS_INTERVAL = 0.5          # seconds between progress writes from a worker
+POLL_INTERVAL = 1.5              # seconds between UI status checks while a job runs
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_EXPIRED = "expired"
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE)     # reusable for an identical request
+
+_pool = None
+_pool_lock = threading.Lock()
+_initialised = set()
+HOST = socket.gethostname()
+
+
+def _process_alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)       # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259                                # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _owner_gone(host, pid):
+    # Jobs from before owners were recorded have none; another host's processes can't
+    # be checked from here, so those are left to their own host.
+    if host is None or pid is None:
+        return True
+    return host == HOST and pid != os.getpid() and not _process_alive(pid)
+
+
+def _fail_orphans(conn, candidates):
+    orphans = [(JOB_FAILED, time.time(), job_id) for job_id, host, pid in candidates if _owner_gone(host, pid)]
+    conn.executemany("UPDATE jobs SET status = ?, error = 'interrupted by a server restart', finished_at = ? "
+                     "WHERE job_id = ?", orphans)
+    return len(orphans)
+
+
+def init_job_db():
+    # Creates the jobs table; the first call in a process also fails jobs left queued
+    # or running by server processes that have since exited.
+    path = os.path.abspath(database.USER_DB_PATH)
+    with database.connect(database.USER_DB_PATH) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                job_key TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT,
+                file_name TEXT,
+                result_path TEXT,
+                error TEXT,
+                created_by TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner_host TEXT,
+                owner_pid INTEGER
+            )
+        """)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+        for column, kind in (("owner_host", "TEXT"), ("owner_pid", "INTEGER")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        conn.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_active_key ON jobs(job_key)
+            WHERE status IN {ACTIVE_STATUSES}
+        """)
+        if path not in _initialised:
+            _fail_orphans(conn, conn.execute("SELECT job_id, owner_host, owner_pid FROM jobs WHERE status IN (?, ?)",
+                                             (JOB_QUEUED, JOB_RUNNING)).fetchall())
+            _initialised.add(path)
+        conn.commit()
+
+
+def _get_pool():
+    # Spawned workers, like the report chart pool: the server process is multi-threaded
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+# ----------------- JOB KINDS -----------------
+# kind -> (function(path, params, progress), file extension, mime). Functions run in a
+# worker process; params are the JSON-decoded submit() params.
+def _station_logs_xlsx(path, params, progress):
+    total = database.count_station_logs(**params)
+    exports.export_station_logs(path, progress=lambda rows: progress(rows / max(total, 1), f"{rows:,} / {total:,} rows"),
+                                **params)
+
+
+def _monthly_report_pdf(path, params, progress):
+    progress(0.1, "rendering charts")
+    try:
+        reports.build_monthly_report(path, date.fromisoformat(params["month"]),
+                                     database.get_zone_sps_mapping(), database.get_zone_groups())
+    finally:
+        # The chart pool's processes are children of this worker; left running they
+        # keep the worker (and shutdown_pool) from ever exiting
+        reports.shutdown_pool()
+
+
+JOB_KINDS = {
+    "station_logs_xlsx": (_station_logs_xlsx, ".xlsx", exports.XLSX_MIME),
+    "monthly_report_pdf": (_monthly_report_pdf, ".pdf", reports.PDF_MIME),
+}
+
+
+def _json_params(params):
+    return json.dumps(params, sort_keys=True, default=database.format_date)
+
+
+def job_key(kind, params, generation=None):
+    generation = database.get_data_generation() if generation is None else generation
+    return hashlib.sha1(f"{kind}|{_json_params(params)}|{generation}".encode()).hexdigest()
+
+
+def _update(job_id, **fields):
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with database.connect(database.USER_DB_PATH) as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", [*fields.values(), job_id])
+        conn.commit()
+
+
+def _run_job(job_id, kind, params, db_paths):
+    # Worker process entry point
+    database.DB_PATH, database.USER_DB_PATH = db_paths
+    function, extension, _ = JOB_KINDS[kind]
+    path = os.path.join(JOB_RESULT_DIR, f"{job_id}{extension}")
+    _update(job_id, status=JOB_RUNNING, started_at=time.time())
+    last_write = [0.0]
+
+    def progress(fraction, message=None):
+        now = time.monotonic()
+        if now - last_write[0] >= PROGRESS_INTERVAL:
+            last_write[0] = now
+            _update(job_id, progress=min(max(fraction, 0.0), 0.99), message=message)
+
+    try:
+        function(path, params, progress)
+    except Exception as e:
+        _update(job_id, status=JOB_FAILED, error=f"{type(e).__name__}: {e}", finished_at=time.time())
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    _update(job_id, status=JOB_DONE, progress=1.0, message=None, result_path=path, finished_at=time.time())
+
+
+def submit(kind, params, file_name, created_by=None, generation=None):
+    # Returns the job_id of a new job, or of an identical queued/running/finished one
+    evict_expired()
+    key = job_key(kind, params, generation)
+    job_id = uuid.uuid4().hex
+    with database.connect(database.USER_DB_PATH) as conn:
+        inserted = conn.execute(f"""
+            INSERT INTO jobs (job_id, job_key, kind, params, status, file_name, created_by, created_at,
+                              owner_host, owner_pid)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(job_key) WHERE status IN {ACTIVE_STATUSES} DO NOTHING
+        """, (job_id, key, kind, _json_params(params), JOB_QUEUED, file_name, created_by, time.time(),
+              HOST, os.getpid())).rowcount
+        conn.commit()
+        if not inserted:
+            existing, status, path, host, pid = conn.execute(
+                f"SELECT job_id, status, result_path, owner_host, owner_pid FROM jobs "
+                f"WHERE job_key = ? AND status IN {ACTIVE_STATUSES}", (key,)).fetchone()
+            if status != JOB_DONE and _fail_orphans(conn, [(existing, host, pid)]):
+                # Its owner exited after this process started; run the job again here
+                conn.commit()
+                return submit(kind, params, file_name, created_by, generation)
+            if status != JOB_DONE or os.path.exists(path or ""):
+                return existing
+            # Result file was removed behind our back; run the job again
+            conn.execute("UPDATE jobs SET status = ? WHERE job_id = ?", (JOB_EXPIRED, existing))
+            conn.commit()
+            return submit(kind, params, file_name, created_by, generation)
+
+    os.makedirs(JOB_RESULT_DIR, exist_ok=True)
+    paths = (os.path.abspath(database.DB_PATH), os.path.abspath(database.USER_DB_PATH))
+    _get_pool().submit(_run_job, job_id, kind, json.loads(_json_params(params)), paths)
+    return job_id
+
+
+def get_job(job_id):
+    with database.connect(database.USER_DB_PATH) as conn:
+        cursor = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([col[0] for col in cursor.description], row))
+    if job["status"] == JOB_DONE and not os.path.exists(job["result_path"] or ""):
+        job["status"] = JOB_EXPIRED
+    job["mime"] = JOB_KINDS[job["kind"]][2]
+    return job
+
+
+def read_result(job):
+    with open(job["result_path"], "rb") as f:
+        return f.read()
+
+
+def evict_expired(ttl=JOB_RESULT_TTL):
+    # Deletes result files older than ttl and marks their jobs expired
+    cutoff = time.time() - ttl
+    with database.connect(database.USER_DB_PATH) as conn:
+        expired = conn.execute("SELECT job_id, result_path FROM jobs WHERE status = ? AND finished_at < ?",
+                               (JOB_DONE, cutoff)).fetchall()
+        for _, path in expired:
+            if path and os.path.exists(path):
+                os.remove(path)
+        conn.executemany("UPDATE jobs SET status = ? WHERE job_id = ?", [(JOB_EXPIRED, j) for j, _ in expired])
+        conn.commit()
+    return len(expired)
+
+
+def list_jobs(limit=20):
+    with database.connect(database.USER_DB_PATH) as conn:
+        cursor = conn.execute("SELECT job_id, kind, file_name, status, progress, created_by, created_at, finished_at "
+                              "FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -0,0 +1,92 @@
+import argparse
+import sys
+
+import database
+import snapshot
+
+# ----------------- COMMANDS -----------------
+def cmd_rebuild_rollups(args):
+    database.init_db()
+    database.rebuild_rollups()
+    print("✅ Rollup tables rebuilt from station_logs.")
+
+
+def cmd_check_rollups(args):
+    database.init_db()
+    mismatches = database.check_rollups(tolerance=args.tolerance)
+    if mismatches.empty:
+        print("✅ Rollup tables match station_logs.")
+        return 0
+    print(mismatches.to_string(index=False))
+    print(f"❌ {len(mismatches)} rollup rows differ from station_logs. Run 'rebuild-rollups' to fix.")
+    return 1
+
+
+def cmd_rebuild_anomalies(args):
+    database.init_db()
+    database.rebuild_flow_stats()
+    print("✅ Flow anomaly state and flags recomputed from station_logs.")
+
+
+def cmd_rollover(args):
+    database.init_db()
+    moved = database.rollover_partitions(hot_years=args.hot_years)
+    for year, rows in moved.items():
+        print(f"📦 {year}: {rows:,} rows moved to {database.partition_path(year)}")
+    if not moved:
+        print("✅ Nothing to archive.")
+
+
+def cmd_restore_partition(args):
+    database.init_db()
+    rows = database.restore_partition(args.year)
+    print(f"✅ {args.year}: {rows:,} rows moved back into station_logs.")
+
+
+def cmd_list_partitions(args):
+    database.init_db()
+    partitions = database.list_partitions()
+    print(partitions.to_string(index=False) if not partitions.empty else "No archived years.")
+
+
+def cmd_refresh_snapshot(args):
+    database.init_db()
+    if args.rebuild:
+        snapshot.clear()
+    rebuilt = snapshot.refresh()
+    for month, rows in sorted(rebuilt.items()):
+        print(f"🗂️ {month // 100}-{month % 100:02d}: {rows:,} rows")
+    print(f"✅ Snapshot in {snapshot.snapshot_dir()} is up to date.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="STP field log maintenance commands")
+    parser.add_argument("--db", help="station database path (default: %(default)s)", default=database.DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("rebuild-rollups", help="recompute the daily rollup tables from raw logs") \
+        .set_defaults(func=cmd_rebuild_rollups)
+    check = sub.add_parser("check-rollups", help="compare the daily rollup tables against raw logs")
+    check.add_argument("--tolerance", type=float, default=1e-6)
+    check.set_defaults(func=cmd_check_rollups)
+    sub.add_parser("rebuild-anomalies", help="rescore every entry for flow anomalies (after backfills)") \
+        .set_defaults(func=cmd_rebuild_anomalies)
+    rollover = sub.add_parser("rollover", help="move years before the hot window into yearly archive files")
+    rollover.add_argument("--hot-years", type=int, default=database.HOT_YEARS,
+                          help="years kept in station_logs, counting the current one (default: %(default)s)")
+    rollover.set_defaults(func=cmd_rollover)
+    restore = sub.add_parser("restore-partition", help="move an archived year back into station_logs")
+    restore.add_argument("year", type=int)
+    restore.set_defaults(func=cmd_restore_partition)
+    sub.add_parser("list-partitions", help="list the archived years").set_defaults(func=cmd_list_partitions)
+    refresh = sub.add_parser("refresh-snapshot", help="bring the columnar snapshot up to date")
+    refresh.add_argument("--rebuild", action="store_true", help="rebuild every month from scratch")
+    refresh.set_defaults(func=cmd_refresh_snapshot)
+
+    args = parser.parse_args(argv)
+    database.DB_PATH = args.db
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# ----------------- TIMING SPANS -----------------
+# Lightweight per-rerun instrumentation. app.py starts a "run" at the top of every
+# Streamlit rerun; spans opened on that thread (DB calls, DataFrame transforms, export
+# builds, figure construction) are appended to it. Outside a run (manage.py, benchmarks)
+# spans cost one thread-local lookup and record nothing.
+LOG_PATH = None              # set to a file path to append finished runs as JSON lines
+SLOW_SPANS_SHOWN = 15
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def start_run(label, previous=None):
+    # Finishes `previous` (the last rerun's dict, usually kept in session_state) and
+    # installs a fresh run for this thread. Runs are finished on the next rerun rather
+    # than at the end of the script, because st.stop()/st.rerun() abort the script.
+    if previous is not None:
+        finish_run(previous)
+    run = {"label": label, "started": datetime.now().isoformat(timespec="seconds"),
+           "t0": time.perf_counter(), "spans": [], "depth": 0, "total_ms": None}
+    _local.run = run
+    return run
+
+
+def finish_run(run):
+    if run.get("total_ms") is not None:
+        return run
+    # Wall time up to the end of the last span (the script itself may have been aborted)
+    ends = [s["start_ms"] + s["ms"] for s in run["spans"]]
+    run["total_ms"] = max(ends, default=0.0)
+    if LOG_PATH:
+        record = {k: run[k] for k in ("label", "started", "total_ms")}
+        record["spans"] = run["spans"]
+        with _log_lock, open(LOG_PATH, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+    return run
+
+
+def current_run():
+    return getattr(_local, "run", None)
+
+
+@contextmanager
+def span(name, **detail):
+    # Yields the span's detail dict so callers can attach results, e.g. detail["rows"] = len(df)
+    run = getattr(_local, "run", None)
+    if run is None:
+        yield detail
+        return
+    start = time.perf_counter()
+    run["depth"] += 1
+    try:
+        yield detail
+    finally:
+        run["depth"] -= 1
+        run["spans"].append({
+            "name": name,
+            "ms": (time.perf_counter() - start) * 1000,
+            "start_ms": (start - run["t0"]) * 1000,
+            "depth": run["depth"],
+            **detail,
+        })
+
+
+def _row_count(result):
+    if isinstance(result, (list, dict, set)) or hasattr(result, "shape"):
+        return len(result)
+    return None
+
+
+def timed(name=None):
+    # Decorator form of span(); records the row count of DataFrame/list results.
+    def decorate(fn):
+        label = name or f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "run", None) is None:
+                return fn(*args, **kwargs)
+            with span(label) as detail:
+                result = fn(*args, **kwargs)
+                rows = _row_count(result)
+                if rows is not None:
+                    detail["rows"] = rows
+                return result
+        return wrapper
+    return decorate
+
+
+def slowest_spans(run, limit=SLOW_SPANS_SHOWN):
+    return sorted(run["spans"], key=lambda s: s["ms"], reverse=True)[:limit]
+
+
+def summarize(run):
+    # Per-name totals: calls, total and max milliseconds, rows
+    totals = {}
+    for s in run["spans"]:
+        entry = totals.setdefault(s["name"], {"name": s["name"], "calls": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0})
+        entry["calls"] += 1
+        entry["total_ms"] += s["ms"]
+        entry["max_ms"] = max(entry["max_ms"], s["ms"])
+        entry["rows"] += s.get("rows") or 0
+    return sorted(totals.values(), key=lambda e: e["total_ms"], reverse=True)
@@ -0,0 +1,228 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import pandas as pd
+from fpdf import FPDF
+
+import analytics
+import database
+import perf
+
+# ----------------- MONTHLY PDF REPORT -----------------
+# One PDF per month: summary metrics, the per-zone table and critical SPS on the first
+# pages, then one daily trend chart per zone. Charts are drawn with matplotlib in a
+# process pool while the text pages are laid out, and each PNG is cached on disk under
+# a hash of the exact data it plots, so only zones whose data changed are redrawn.
+# Pages are added as each chart becomes available, in zone order.
+REPORT_CACHE_DIR = "report_cache"
+MAX_CACHED_IMAGES = 500
+RENDER_WORKERS = min(4, os.cpu_count() or 1)     # 0 renders in-process
+CHART_STYLE_VERSION = 1                          # bump when the chart look changes
+CRITICAL_ROWS_LIMIT = 300
+PDF_MIME = "application/pdf"
+
+_pool = None
+
+
+def _get_pool():
+    # Spawned (not forked) workers: the Streamlit server process is multi-threaded
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def render_chart(path, title, ylabel, dates, series):
+    # Runs in a worker process; series is [(label, values)] aligned with dates.
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    from PIL import Image
+
+    fig, ax = plt.subplots(figsize=(10, 4.2), dpi=110)
+    for label, values in series:
+        ax.plot(dates, values, linewidth=1.3, marker="o" if len(dates) <= 31 else None, markersize=2.5, label=label)
+    ax.set_title(title, fontsize=12)
+    ax.set_ylabel(ylabel)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%d/%m"))
+    ax.grid(alpha=0.3)
+    if 1 < len(series) <= 12:
+        ax.legend(fontsize=7, ncol=2, loc="upper left", bbox_to_anchor=(1.0, 1.0))
+    fig.tight_layout()
+    # Saved as RGB: FPDF 1.7 splits an alpha channel out of RGBA PNGs in pure Python,
+    # which costs over a second per chart; RGB PNG data is embedded as is.
+    fig.canvas.draw()
+    image = Image.frombuffer("RGBA", fig.canvas.get_width_height(), fig.canvas.buffer_rgba()).convert("RGB")
+    plt.close(fig)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    image.save(tmp, format="PNG")
+    os.replace(tmp, path)
+    return path
+
+
+def month_range(day):
+    start = day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+def _zone_charts(start_date, end_date, zone_sps_map, zone_groups):
+    # [(zone, title, ylabel, dates, series)] in registry order, one daily chart per zone
+    measure_of = {zone: "income_mld" for zone in zone_groups.get("plant", ())}
+    daily = database.load_daily_rollup("sps", start_date, end_date)
+    dates = pd.date_range(start_date, end_date, freq="D")
+    charts = []
+    for zone, names in zone_sps_map.items():
+        key = zone.strip().lower()
+        measure = measure_of.get(key, "pumping_mld")
+        data = daily[daily["zone"] == key]
+        wide = data.pivot(index="entry_date", columns="sps_name", values=measure).reindex(dates)
+        series = [(name, wide[name].round(3).tolist()) for name in names if name in wide.columns]
+        label = "Income MLD" if measure == "income_mld" else "Pumping MLD"
+        charts.append((zone, f"{zone} - Daily {label}", label, [d.date() for d in dates], series))
+    return charts
+
+
+def _image_path(chart):
+    _, title, ylabel, dates, series = chart
+    digest = hashlib.sha1(repr((CHART_STYLE_VERSION, title, ylabel, dates, series)).encode()).hexdigest()
+    return os.path.join(REPORT_CACHE_DIR, f"{digest}.png")
+
+
+def _prune_image_cache():
+    files = [os.path.join(REPORT_CACHE_DIR, f) for f in os.listdir(REPORT_CACHE_DIR) if f.endswith(".png")]
+    if len(files) > MAX_CACHED_IMAGES:
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - MAX_CACHED_IMAGES]:
+            os.remove(path)
+
+
+def _submit_charts(charts):
+    # Returns one entry per chart: a cached path (str) or a Future producing it
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    pending = []
+    for chart in charts:
+        path = _image_path(chart)
+        if os.path.exists(path):
+            os.utime(path)
+            pending.append(path)
+        elif not chart[4]:
+            pending.append(None)        # nothing logged in this zone
+        elif RENDER_WORKERS:
+            pending.append(_get_pool().submit(render_chart, path, *chart[1:]))
+        else:
+            pending.append(render_chart(path, *chart[1:]))
+    return pending
+
+
+def _text(value):
+    # The core FPDF fonts are latin-1 only
+    return str(value).encode("latin-1", "replace").decode("latin-1")
+
+
+def _table(pdf, columns, rows, widths):
+    pdf.set_font("Arial", "B", 9)
+    for column, width in zip(columns, widths):
+        pdf.cell(width, 7, _text(column), border=1, align="C")
+    pdf.ln()
+    pdf.set_font("Arial", size=9)
+    for row in rows:
+        for value, width in zip(row, widths):
+            text = f"{value:.2f}" if isinstance(value, float) else value
+            pdf.cell(width, 6, _text(text), border=1)
+        pdf.ln()
+
+
+def _summary_pages(pdf, summary, critical, start_date, end_date):
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(0, 10, _text(f"Monthly Pumping Report - {start_date.strftime('%B %Y')}"), ln=True, align="C")
+    pdf.set_font("Arial", size=10)
+    pdf.cell(0, 6, _text(f"{start_date.strftime('%d-%m-%Y')} to {end_date.strftime('%d-%m-%Y')}, "
+                         f"{summary.rows:,} log entries"), ln=True, align="C")
+    pdf.ln(4)
+
+    metrics = [
+        ("Total SPS pumping MLD", summary.stat("sps", "pumping_mld")),
+        ("Average SPS pumping MLD", summary.stat("sps", "pumping_mld", "mean")),
+        ("Plant income MLD", summary.stat("plant", "income_mld")),
+        ("Plant supply MLD", summary.stat("plant", "supply_mld")),
+        ("TSPS pumping MLD", summary.stat("tsps", "pumping_mld")),
+    ]
+    _table(pdf, ["Metric", "Value"], metrics, [110, 60])
+    pdf.ln(6)
+
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, "Total Pumping per Zone", ln=True)
+    _table(pdf, ["Zone", "Pumping MLD", "Income MLD", "Supply MLD"],
+           summary.zone_table.itertuples(index=False, name=None), [40, 45, 45, 45])
+    pdf.ln(6)
+
+    critical = critical.sort_values(["entry_date", "zone", "sps_name"], ascending=[False, True, True])
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, f"Critical SPS (standby pumps = 0): {len(critical):,} stations", ln=True)
+    rows = [(d.strftime("%d-%m-%Y"), z.upper(), s, int(n), "Yes" if still else "No") for d, z, s, n, still in
+            critical[["entry_date", "zone", "sps_name", "critical_days", "still_critical"]].head(CRITICAL_ROWS_LIMIT)
+            .itertuples(index=False, name=None)]
+    _table(pdf, ["Last critical", "Zone", "SPS", "Days", "Still"], rows, [35, 25, 90, 20, 20])
+    if len(critical) > CRITICAL_ROWS_LIMIT:
+        pdf.set_font("Arial", "I", 9)
+        pdf.cell(0, 6, f"... {len(critical) - CRITICAL_ROWS_LIMIT:,} more stations (see the Critical SPS export)", ln=True)
+
+
+@perf.timed()
+def build_monthly_report(path, month, zone_sps_map, zone_groups):
+    # Writes the report for the month containing `month` to path; returns the page count
+    start_date, end_date = month_range(month)
+    end_date = min(end_date, max(date.today(), start_date))
+    with perf.span("report.submit_charts") as detail:
+        charts = _zone_charts(start_date, end_date, zone_sps_map, zone_groups)
+        pending = _submit_charts(charts)
+        detail["rendered"] = sum(not isinstance(p, (str, type(None))) for p in pending)
+
+    pdf = FPDF(orientation="P", unit="mm", format="A4")
+    pdf.set_auto_page_break(True, margin=12)
+    summary = analytics.load_summary(start_date, end_date, zone_groups)
+    _summary_pages(pdf, summary, database.load_critical_sps(start_date, end_date), start_date, end_date)
+
+    # Two charts per page, added in zone order as each image is ready
+    with perf.span("report.chart_pages"):
+        for n, (chart, image) in enumerate(zip(charts, pending)):
+            if n % 2 == 0:
+                pdf.add_page()
+            y = 12 if n % 2 == 0 else 150
+            if image is None:
+                pdf.set_xy(10, y)
+                pdf.set_font("Arial", "I", 10)
+                pdf.cell(0, 8, _text(f"{chart[0]}: no entries this month"))
+                continue
+            if not isinstance(image, str):
+                image = image.result()
+            pdf.image(image, x=10, y=y, w=190)
+
+    pdf.output(path, "F")
+    _prune_image_cache()
+    return pdf.page_no()
+
+
+def monthly_report_pdf(month, zone_sps_map, zone_groups):
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        build_monthly_report(path, month, zone_sps_map, zone_groups)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
@@ -0,0 +1,262 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import database
+import perf
+
+# ----------------- COLUMNAR SNAPSHOT -----------------
+# A copy of station_logs as one NumPy .npy file per column, split into one segment per
+# month and sorted by (entry_day, sps_name). Segments are memory-mapped on read, so a
+# date range is a searchsorted slice of the day column and every Streamlit (or job)
+# process shares the same pages through the OS page cache. Text columns are stored as
+# int32 codes into a per-segment dictionary.
+#
+# log_month_generation (bumped by triggers on every write) says which months changed;
+# the next read rebuilds just those segments, so a save costs the next reader one
+# month's rebuild. Segment directories are never modified in place: a rebuild writes a
+# new directory and swaps it into meta.json atomically, so readers in other processes
+# keep a consistent view.
+ENABLED = True
+TEXT_COLUMNS = ["zone", "username", "sps_name", "remarks"]
+INTEGER_COLUMNS = ["total_pumps", "working_pumps", "standby_pumps", "standby_um", "station_id"]
+REAL_COLUMNS = ["pumping_mld", "income_mld", "supply_mld"]
+FRAME_COLUMNS = database.STATION_COLUMNS + ["station_id"]
+GARBAGE_AGE = 10 * 60           # seconds an unreferenced segment directory is kept
+
+_lock = threading.Lock()
+_meta_cache = {}                # snapshot dir -> (meta.json mtime_ns, meta)
+_segments = {}                  # segment dir -> (arrays, dictionary)
+
+
+def snapshot_dir():
+    return os.path.splitext(database.DB_PATH)[0] + "_snapshot"
+
+
+def _meta_path():
+    return os.path.join(snapshot_dir(), "meta.json")
+
+
+def _read_meta():
+    path = _meta_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    cached = _meta_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path) as f:
+        meta = {int(month): segment for month, segment in json.load(f).items()}
+    _meta_cache[path] = (mtime, meta)
+    return meta
+
+
+def _write_meta(meta):
+    path = _meta_path()
+    temporary = f"{path}.{uuid.uuid4().hex}"
+    with open(temporary, "w") as f:
+        json.dump({str(month): segment for month, segment in sorted(meta.items())}, f)
+    os.replace(temporary, path)
+
+
+@perf.timed()
+def _build_segment(month):
+    # Returns the new segment's directory name, or None for a month without rows
+    start_date, end_date = _month_range(month)
+    df = database.load_station_logs(start_date=start_date, end_date=end_date)
+    if df.empty:
+        return None
+    df = df.sort_values(["entry_date", "sps_name"], kind="stable")
+    name = f"{month}-{uuid.uuid4().hex[:12]}"
+    directory = os.path.join(snapshot_dir(), name)
+    os.makedirs(directory)
+    dictionary = {}
+    np.save(os.path.join(directory, "entry_day.npy"),
+            df["entry_date"].to_numpy().astype("datetime64[D]").astype(np.int32))
+    for column in TEXT_COLUMNS:
+        codes, values = pd.factorize(df[column], use_na_sentinel=False)
+        np.save(os.path.join(directory, f"{column}.npy"), codes.astype(np.int32))
+        dictionary[column] = [None if pd.isna(value) else value for value in values]
+    for column in INTEGER_COLUMNS + REAL_COLUMNS:
+        np.save(os.path.join(directory, f"{column}.npy"), pd.to_numeric(df[column], errors="coerce").to_numpy(np.float64))
+    np.save(os.path.join(directory, "version.npy"), df["version"].to_numpy(np.int64))
+    with open(os.path.join(directory, "dictionary.json"), "w") as f:
+        json.dump(dictionary, f)
+    return name
+
+
+def _collect_garbage(meta):
+    live = {segment["dir"] for segment in meta.values() if segment["dir"]}
+    cutoff = time.time() - GARBAGE_AGE
+    for name in os.listdir(snapshot_dir()):
+        path = os.path.join(snapshot_dir(), name)
+        if name in live or not os.path.isdir(path) or os.path.getmtime(path) > cutoff:
+            continue
+        _segments.pop(path, None)
+        shutil.rmtree(path, ignore_errors=True)     # may still be mapped elsewhere (Windows)
+
+
+@perf.timed()
+def refresh():
+    # Rebuilds the segments of months that changed since they were built; returns
+    # {YYYYMM: rows} for the rebuilt ones.
+    generations = database.get_month_generations()
+    with _lock:
+        meta = dict(_read_meta())
+        stale = [month for month, generation in generations.items()
+                 if meta.get(month, {}).get("generation") != generation]
+        if not stale:
+            return {}
+        os.makedirs(snapshot_dir(), exist_ok=True)
+        rebuilt = {}
+        for month in stale:
+            # A write during the build leaves the stored generation behind, so the
+            # month is simply rebuilt again on the next read.
+            name = _build_segment(month)
+            meta[month] = {"dir": name, "generation": generations[month]}
+            rebuilt[month] = len(_segment(name)[0]["entry_day"]) if name else 0
+        for month in set(meta) - set(generations):
+            del meta[month]
+        _write_meta(meta)
+        _collect_garbage(meta)
+        return rebuilt
+
+
+def _segment(name):
+    path = os.path.join(snapshot_dir(), name)
+    cached = _segments.get(path)
+    if cached is None:
+        columns = ["entry_day", "version"] + TEXT_COLUMNS + INTEGER_COLUMNS + REAL_COLUMNS
+        arrays = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r") for column in columns}
+        with open(os.path.join(path, "dictionary.json")) as f:
+            dictionary = json.load(f)
+        cached = _segments[path] = (arrays, dictionary)
+    return cached
+
+
+def _select(zone=None, start_date=None, end_date=None, sps_name=None, username=None):
+    # Yields (arrays, dictionary, row selector) for each segment with matching rows, in
+    # entry_date order. The selector is a slice (views into the mapped files) unless a
+    # zone/SPS/user filter needs a mask.
+    refresh()
+    start_day = database.day_number(start_date) if start_date else None
+    end_day = database.day_number(end_date) if end_date else None
+    equals = {"zone": zone.strip().lower() if zone else None, "sps_name": sps_name, "username": username}
+    first = start_date.year * 100 + start_date.month if start_date else None
+    last = end_date.year * 100 + end_date.month if end_date else None
+    meta = _read_meta()
+    for month in sorted(meta):
+        if not meta[month]["dir"] or (first and month < first) or (last and month > last):
+            continue
+        arrays, dictionary = _segment(meta[month]["dir"])
+        days = arrays["entry_day"]
+        low = int(np.searchsorted(days, start_day, "left")) if start_day is not None else 0
+        high = int(np.searchsorted(days, end_day, "right")) if end_day is not None else len(days)
+        if low >= high:
+            continue
+        rows = slice(low, high)
+        mask = None
+        for column, value in equals.items():
+            if not value:
+                continue
+            if value not in dictionary[column]:
+                break
+            matches = arrays[column][rows] == dictionary[column].index(value)
+            mask = matches if mask is None else mask & matches
+        else:
+            selector = rows if mask is None else np.flatnonzero(mask) + low
+            if mask is None or len(selector):
+                yield arrays, dictionary, selector
+
+
+def _integers(values):
+    # int64 when the selection has no NULLs, like read_sql_query; float64 with NaN otherwise
+    return values.astype(np.int64) if not np.isnan(values).any() else values
+
+
+def _decode(arrays, dictionary, selector):
+    columns = {"entry_date": arrays["entry_day"][selector]}
+    for column in TEXT_COLUMNS:
+        columns[column] = np.asarray(dictionary[column], dtype=object)[arrays[column][selector]]
+    for column in INTEGER_COLUMNS + REAL_COLUMNS + ["version"]:
+        columns[column] = arrays[column][selector]
+    return columns
+
+
+@perf.timed()
+def load_station_logs(zone=None, start_date=None, end_date=None, sps_name=None, username=None):
+    # Same filters and columns as database.load_station_logs, read from the snapshot.
+    # Rows come back in (entry_date, sps_name) order.
+    if not ENABLED:
+        return database.load_station_logs(zone=zone, start_date=start_date, end_date=end_date,
+                                          sps_name=sps_name, username=username)
+    start_date = _as_date(start_date)
+    end_date = _as_date(end_date)
+    parts = [_decode(*selected) for selected in _select(zone, start_date, end_date, sps_name, username)]
+    if not parts:
+        # Nothing matches; an empty SQL result has the right columns and dtypes
+        return database.load_station_logs(zone=zone, start_date=start_date, end_date=end_date,
+                                          sps_name=sps_name, username=username).iloc[0:0]
+    columns = {column: np.concatenate([part[column] for part in parts]) if len(parts) > 1 else parts[0][column]
+               for column in parts[0]}
+    columns["entry_date"] = database.days_to_datetime(columns["entry_date"])
+    for column in INTEGER_COLUMNS:
+        columns[column] = _integers(columns[column])
+    return pd.DataFrame({column: columns[column] for column in FRAME_COLUMNS}, copy=False)
+
+
+def iter_station_logs(chunk_size=5000, zone=None, start_date=None, end_date=None, sps_name=None, username=None):
+    # Same protocol as database.iter_station_logs: column names first, then lists of
+    # row tuples in (entry_date, sps_name) order.
+    if not ENABLED:
+        yield from database.iter_station_logs(chunk_size, zone=zone, start_date=start_date, end_date=end_date,
+                                              sps_name=sps_name, username=username)
+        return
+    yield list(database.STATION_COLUMNS)
+    for arrays, dictionary, selector in _select(zone, _as_date(start_date), _as_date(end_date), sps_name, username):
+        columns = _decode(arrays, dictionary, selector)
+        total = len(columns["entry_date"])
+        for start in range(0, total, chunk_size):
+            part = {column: values[start:start + chunk_size] for column, values in columns.items()}
+            part["entry_date"] = np.datetime_as_string(part["entry_date"].astype("datetime64[D]"))
+            for column in INTEGER_COLUMNS + REAL_COLUMNS:
+                part[column] = _python_values(part[column], integer=column in INTEGER_COLUMNS)
+            yield list(zip(*(part[column].tolist() if isinstance(part[column], np.ndarray) else part[column]
+                             for column in database.STATION_COLUMNS)))
+
+
+def _python_values(values, integer):
+    # NULLs come back as None and integers as int, like rows fetched from SQLite
+    missing = np.isnan(values)
+    result = values.astype(np.int64).tolist() if integer and not missing.any() else values.tolist()
+    if missing.any():
+        result = [None if gap else (int(value) if integer else value) for value, gap in zip(result, missing)]
+    return result
+
+
+def _month_range(month):
+    # First and last date of a YYYYMM month
+    year, number = divmod(month, 100)
+    following = date(year + number // 12, number % 12 + 1, 1)
+    return date(year, number, 1), following - timedelta(days=1)
+
+
+def _as_date(value):
+    return None if value is None else database.EPOCH + timedelta(days=database.day_number(value))
+
+
+def clear():
+    # Drops the snapshot for the current database; it is rebuilt on the next read
+    with _lock:
+        _meta_cache.pop(_meta_path(), None)
+        for path in [p for p in _segments if p.startswith(snapshot_dir() + os.sep)]:
+            del _segments[path]
+        shutil.rmtree(snapshot_dir(), ignore_errors=True)
@@ -0,0 +1,108 @@
+import random
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+
+STATIONS = [("plant", "Vasna-240 MLD", 240.0), ("ez", "Rakhiyal", 90.0), ("plant", "Vasna-126 MLD", 126.0)]
+START = date(2025, 1, 1)
+DAYS = 120
+
+
+@pytest.fixture
+def station_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "station_data.db"))
+    monkeypatch.setattr(database, "USER_DB_PATH", str(tmp_path / "app_data.db"))
+    database.close_connections()
+    database.init_db()
+    yield
+    database.close_connections()
+
+
+def _entry(day, zone, sps_name, flow):
+    return {
+        "entry_date": (START + timedelta(days=day)).isoformat(), "zone": zone, "username": "operator",
+        "sps_name": sps_name, "total_pumps": 4, "working_pumps": 3, "standby_pumps": 1, "standby_um": 0,
+        "remarks": "", "pumping_mld": flow, "income_mld": flow * 0.9, "supply_mld": None,
+    }
+
+
+def _save_history(seed):
+    rng = random.Random(seed)
+    for day in range(DAYS):
+        for zone, sps_name, capacity in STATIONS:
+            if rng.random() < 0.1:
+                continue        # missed day
+            flow = round(capacity * rng.uniform(0.6, 0.8), 2)
+            if rng.random() < 0.03:
+                flow = 0.0      # outage
+            database.save_station_entry(_entry(day, zone, sps_name, flow))
+    return rng
+
+
+def _flags():
+    with database.connect(database.DB_PATH) as conn:
+        return pd.read_sql_query(
+            "SELECT sps_name, entry_day, measure, z_score FROM flow_anomalies ORDER BY sps_name, entry_day, measure",
+            conn)
+
+
+def _assert_state_matches_window():
+    # Each flow_stats row must describe exactly the readings in its window
+    with database.connect(database.DB_PATH) as conn:
+        state = pd.read_sql_query("SELECT * FROM flow_stats", conn)
+        for row in state.itertuples():
+            values = pd.Series([value for (value,) in conn.execute(
+                f"SELECT {row.measure} FROM station_logs WHERE station_id = ? AND entry_day > ? AND entry_day <= ?",
+                (row.station_id, row.last_day - database.FLOW_WINDOW_DAYS, row.last_day))], dtype=float).dropna()
+            assert row.n == len(values)
+            if len(values):
+                assert row.mean == pytest.approx(values.mean(), abs=1e-9)
+                assert row.m2 == pytest.approx(values.var(ddof=0) * len(values), abs=1e-6)
+
+
+def _assert_matches_rebuild():
+    _assert_state_matches_window()
+    incremental = _flags()
+    database.rebuild_flow_stats()
+    rebuilt = _flags()
+    keys = ["sps_name", "entry_day", "measure"]
+    assert incremental[keys].equals(rebuilt[keys])
+    assert incremental["z_score"].to_numpy() == pytest.approx(rebuilt["z_score"].to_numpy(), rel=1e-9)
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_incremental_state_matches_rebuild(station_db, seed):
+    rng = _save_history(seed)
+    _assert_matches_rebuild()
+
+    for _ in range(15):
+        zone, sps_name, capacity = rng.choice(STATIONS)
+        day = rng.randrange(DAYS)
+        entry_date = (START + timedelta(days=day)).isoformat()
+        action = rng.choice(["overwrite", "delete", "backfill"])
+        if action == "delete":
+            database.delete_station_entry(entry_date, sps_name)
+        elif action == "overwrite" or database.get_entry(entry_date, sps_name) is None:
+            database.save_station_entry(_entry(day, zone, sps_name, round(capacity * rng.uniform(0.1, 1.5), 2)),
+                                        database.SAVE_OVERWRITE)
+    # The latest day edited and deleted, then a write after a gap
+    zone, sps_name, capacity = STATIONS[0]
+    database.save_station_entry(_entry(DAYS - 1, zone, sps_name, capacity * 2), database.SAVE_OVERWRITE)
+    database.delete_station_entry((START + timedelta(days=DAYS - 1)).isoformat(), sps_name)
+    database.save_station_entry(_entry(DAYS + 10, zone, sps_name, capacity * 0.7))
+    _assert_matches_rebuild()
+
+
+def test_sudden_drop_is_flagged(station_db):
+    for day in range(40):
+        database.save_station_entry(_entry(day, "plant", "Vasna-240 MLD", 180.0 + (day % 5)))
+    database.save_station_entry(_entry(40, "plant", "Vasna-240 MLD", 20.0))
+    anomalies = database.load_flow_anomalies(START, START + timedelta(days=40))
+    assert list(anomalies["anomaly"]) == ["income_mld drop", "pumping_mld drop"]
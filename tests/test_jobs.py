@@ -0,0 +1,98 @@
+import subprocess
+import sys
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+import jobs  # noqa: E402
+
+
+@pytest.fixture
+def job_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "station_data.db"))
+    monkeypatch.setattr(database, "USER_DB_PATH", str(tmp_path / "app_data.db"))
+    monkeypatch.chdir(tmp_path)         # job workers write results under ./job_results
+    database.close_connections()
+    database.init_db()
+    jobs.init_job_db()
+    yield
+    jobs.shutdown_pool()
+    database.close_connections()
+
+
+def _wait(job_id, timeout=120):
+    deadline = time.monotonic() + timeout
+    while jobs.get_job(job_id)["status"] in (jobs.JOB_QUEUED, jobs.JOB_RUNNING):
+        assert time.monotonic() < deadline, "job did not finish"
+        time.sleep(0.2)
+    return jobs.get_job(job_id)
+
+
+def test_pool_shuts_down_after_a_report_job(job_db):
+    month = date.today().replace(day=1)
+    database.save_station_entry({
+        "entry_date": month.isoformat(), "zone": "wz", "username": "operator", "sps_name": "Ranip",
+        "total_pumps": 4, "working_pumps": 3, "standby_pumps": 1, "standby_um": 0, "remarks": "",
+        "pumping_mld": 12.5, "income_mld": None, "supply_mld": None,
+    })
+    job = _wait(jobs.submit("monthly_report_pdf", {"month": month}, "report.pdf"))
+    assert job["status"] == jobs.JOB_DONE, job["error"]
+    # The report's chart pool lived inside the job worker; it must not keep it alive
+    stopper = threading.Thread(target=jobs.shutdown_pool, daemon=True)
+    stopper.start()
+    stopper.join(30)
+    assert not stopper.is_alive(), "shutdown_pool hung"
+
+
+def _insert_job(job_id, host, pid, status=jobs.JOB_RUNNING, key=None):
+    with database.connect(database.USER_DB_PATH) as conn:
+        conn.execute("INSERT INTO jobs (job_id, job_key, kind, params, status, created_at, owner_host, owner_pid) "
+                     "VALUES (?, ?, 'station_logs_xlsx', '{}', ?, ?, ?, ?)",
+                     (job_id, key or job_id, status, time.time(), host, pid))
+        conn.commit()
+
+
+def _restart(monkeypatch):
+    # What a new server process sharing app_data.db does on its first init_job_db
+    monkeypatch.setattr(jobs, "_initialised", set())
+    jobs.init_job_db()
+
+
+def test_restart_fails_only_jobs_whose_owner_is_gone(job_db, monkeypatch):
+    other = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    try:
+        _insert_job("live", jobs.HOST, other.pid)
+        _insert_job("remote", "another-host", 1)
+        _insert_job("legacy", None, None, status=jobs.JOB_QUEUED)
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        _insert_job("dead", jobs.HOST, dead.pid)
+        _restart(monkeypatch)
+        statuses = {job_id: jobs.get_job(job_id)["status"] for job_id in ("live", "remote", "legacy", "dead")}
+        assert statuses == {"live": jobs.JOB_RUNNING, "remote": jobs.JOB_RUNNING,
+                            "legacy": jobs.JOB_FAILED, "dead": jobs.JOB_FAILED}
+
+        other.kill()
+        other.wait()
+        _restart(monkeypatch)
+        assert jobs.get_job("live")["status"] == jobs.JOB_FAILED
+    finally:
+        other.kill()
+
+
+def test_submit_replaces_a_job_whose_owner_is_gone(job_db):
+    params = {"zone": "wz"}
+    key = jobs.job_key("station_logs_xlsx", params)
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    _insert_job("orphan", jobs.HOST, dead.pid, key=key)
+    job_id = jobs.submit("station_logs_xlsx", params, "logs.xlsx")
+    assert job_id != "orphan"
+    assert jobs.get_job("orphan")["status"] == jobs.JOB_FAILED
+    assert _wait(job_id)["status"] == jobs.JOB_DONE
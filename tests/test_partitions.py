@@ -0,0 +1,99 @@
+import random
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+
+STATIONS = [("wz", "Ranip"), ("wz", "Motera"), ("ez", "Rakhiyal")]
+START = date(2023, 11, 1)       # history runs across the 2023/2024 boundary
+DAYS = 120
+RANGE = (START, START + timedelta(days=DAYS))
+
+
+@pytest.fixture
+def station_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "station_data.db"))
+    monkeypatch.setattr(database, "USER_DB_PATH", str(tmp_path / "app_data.db"))
+    database.close_connections()
+    database.init_db()
+    rng = random.Random(7)
+    for day in range(DAYS):
+        for zone, sps_name in STATIONS:
+            if rng.random() < 0.1:
+                continue        # missed day
+            database.save_station_entry(_entry(START + timedelta(days=day), zone, sps_name, rng))
+    yield
+    database.close_connections()
+
+
+def _entry(day, zone, sps_name, rng):
+    flow = 0.0 if rng.random() < 0.03 else round(rng.uniform(40, 60), 2)
+    standby = 0 if rng.random() < 0.15 else 1
+    return {
+        "entry_date": day.isoformat(), "zone": zone, "username": "operator", "sps_name": sps_name,
+        "total_pumps": 4, "working_pumps": 4 - standby, "standby_pumps": standby, "standby_um": 0,
+        "remarks": "", "pumping_mld": flow, "income_mld": flow * 0.9, "supply_mld": None,
+    }
+
+
+def _views():
+    # Everything that must read the same whether or not 2023 is archived
+    with database.connect(database.DB_PATH) as conn:
+        flow_stats = pd.read_sql_query("SELECT * FROM flow_stats ORDER BY station_id, measure", conn)
+    logs = database.load_station_logs()
+    return {
+        "logs": logs.sort_values(["entry_date", "sps_name"]).reset_index(drop=True),
+        "logs_2023": database.load_station_logs(start_date=date(2023, 1, 1), end_date=date(2023, 12, 31)),
+        "zone_totals": database.load_zone_totals(*RANGE),
+        "daily": database.load_daily_rollup("sps", *RANGE),
+        "critical": database.load_critical_sps(*RANGE),
+        "anomalies": database.load_flow_anomalies(*RANGE),
+        "flow_stats": flow_stats,
+    }
+
+
+def _assert_same(before, after):
+    for name, frame in before.items():
+        pd.testing.assert_frame_equal(after[name].reset_index(drop=True), frame.reset_index(drop=True), obj=name)
+
+
+def test_archive_and_restore_keep_every_view(station_db):
+    before = _views()
+    assert not before["critical"].empty and not before["anomalies"].empty
+
+    assert database.rollover_partitions(today=date(2025, 6, 1)) == {2023: len(before["logs_2023"])}
+    assert list(database.list_partitions()["year"]) == [2023]
+    with database.connect(database.DB_PATH) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM station_logs WHERE entry_date < '2024-01-01'").fetchone()[0] == 0
+    _assert_same(before, _views())
+
+    assert database.restore_partition(2023) == len(before["logs_2023"])
+    assert database.list_partitions().empty
+    _assert_same(before, _views())
+
+
+def test_archived_year_is_read_only(station_db):
+    database.rollover_partitions(today=date(2025, 6, 1))
+    before = _views()
+    entry = database.load_station_logs(start_date=date(2023, 12, 1), end_date=date(2023, 12, 1)).iloc[0]
+    data = _entry(date(2023, 12, 1), entry["zone"], entry["sps_name"], random.Random(1))
+    hot = _entry(date(2024, 1, 1), "wz", "Ranip", random.Random(1))
+
+    with pytest.raises(database.ArchivedEntryError):
+        database.save_station_entry(data, database.SAVE_OVERWRITE)
+    with pytest.raises(database.ArchivedEntryError):
+        database.delete_station_entry(data["entry_date"], data["sps_name"])
+    with pytest.raises(database.ArchivedEntryError):
+        database.apply_entry_batch(updates=[(hot, 1)], deletes=[(data["entry_date"], data["sps_name"])])
+    with pytest.raises(database.ArchivedEntryError):
+        database.import_station_entries([data], policy=database.IMPORT_OVERWRITE)
+    _assert_same(before, _views())      # the rejected batch didn't half-apply either
+
+    database.restore_partition(2023)
+    assert database.save_station_entry(data, database.SAVE_OVERWRITE) == int(entry["version"]) + 1
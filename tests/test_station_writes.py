@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def station_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "station_data.db"))
+    monkeypatch.setattr(database, "USER_DB_PATH", str(tmp_path / "app_data.db"))
+    database.close_connections()
+    database.init_db()
+    yield
+    database.close_connections()
+
+
+def _entry(pumping_mld):
+    return {
+        "entry_date": "2024-03-01", "zone": "wz", "username": "operator", "sps_name": "Ranip",
+        "total_pumps": 4, "working_pumps": 3, "standby_pumps": 1, "standby_um": 0, "remarks": "",
+        "pumping_mld": pumping_mld, "income_mld": None, "supply_mld": None,
+    }
+
+
+def test_direct_writes_read_inside_their_transaction(station_db, monkeypatch):
+    # The archive check and the old flow values must not be read in autocommit ahead of the write
+    checks = []
+    check_not_archived = database._check_not_archived
+
+    def checked(conn, entry_dates):
+        checks.append(conn.in_transaction)
+        return check_not_archived(conn, entry_dates)
+    monkeypatch.setattr(database, "_check_not_archived", checked)
+    assert database.save_station_entry(_entry(10.0)) == 1
+    database.apply_entry_batch(updates=[(_entry(12.0), 1)])
+    database.delete_station_entry("2024-03-01", "Ranip")
+    assert checks and all(checks)
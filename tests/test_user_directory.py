@@ -0,0 +1,57 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def user_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "station_data.db"))
+    monkeypatch.setattr(database, "USER_DB_PATH", str(tmp_path / "app_data.db"))
+    database.close_connections()
+    database.init_user_db()
+    database.register_user("operator", "old", "log entry", "admin")
+    yield
+    database.close_connections()
+
+
+def _other_process(sql, params):
+    # A plain connection of its own, so nothing in this process is invalidated
+    conn = sqlite3.connect(database.USER_DB_PATH)
+    with conn:
+        conn.execute(sql, params)
+    conn.close()
+
+
+def test_password_reset_elsewhere_is_seen(user_db):
+    assert database.authenticate_user("operator", "old")
+    _other_process("UPDATE users SET password = ? WHERE username = ?", ("new", "operator"))
+    assert database.authenticate_user("operator", "old") is None
+    assert database.authenticate_user("operator", "new")
+
+
+def test_changes_elsewhere_are_seen_at_login(user_db):
+    assert database.get_user_section("operator") == "log entry"
+    _other_process("INSERT INTO users VALUES (?, ?, ?, ?, ?)", ("analyst", "pw", "analysis report", "admin", ""))
+    _other_process("UPDATE users SET section = ? WHERE username = ?", ("both", "operator"))
+    assert database.authenticate_user("analyst", "pw")
+    assert database.auth_context("analyst").can_analyze
+    assert database.get_user_section("operator") == "both"
+    _other_process("DELETE FROM users WHERE username = ?", ("analyst",))
+    assert database.authenticate_user("analyst", "pw") is None
+
+
+def test_lookups_between_logins_stay_in_memory(user_db, monkeypatch):
+    database.preload_users()
+
+    def no_database(path):
+        raise AssertionError(f"unexpected connection to {path}")
+    monkeypatch.setattr(database, "connect", no_database)
+    assert database.auth_context("operator").can_log_entry
+    assert database.get_user_section("operator") == "log entry"
+    assert database.get_user_section("nobody") is None
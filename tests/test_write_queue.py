@@ -0,0 +1,60 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+import write_queue  # noqa: E402
+
+
+@pytest.fixture
+def queue_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "station_data.db"))
+    monkeypatch.setattr(write_queue, "WRITE_TIMEOUT", 0.2)
+    database.close_connections()
+    with database.connect(database.DB_PATH) as conn:
+        conn.execute("CREATE TABLE marks (name TEXT)")
+    yield
+    write_queue.shutdown()
+    database.close_connections()
+
+
+def _mark(name, release=None):
+    def apply(conn):
+        if release is not None:
+            release.wait(5)
+        conn.execute("INSERT INTO marks VALUES (?)", (name,))
+        return name
+    return apply
+
+
+def _marks():
+    with database.connect(database.DB_PATH) as conn:
+        return sorted(name for (name,) in conn.execute("SELECT name FROM marks"))
+
+
+def test_timeout_before_start_cancels(queue_db):
+    release = threading.Event()
+    blocking = write_queue.submit(database.DB_PATH, _mark("first", release))
+    with pytest.raises(write_queue.WriteTimeoutError) as error:
+        write_queue._wait(write_queue.submit(database.DB_PATH, _mark("queued")))
+    assert error.value.written is False
+    release.set()
+    assert blocking.result(5) == "first"
+    write_queue.shutdown()
+    assert _marks() == ["first"]
+    assert write_queue.stats()["cancelled"] >= 1
+
+
+def test_timeout_after_start_is_reported_unknown(queue_db):
+    release = threading.Event()
+    future = write_queue.submit(database.DB_PATH, _mark("slow", release))
+    with pytest.raises(write_queue.WriteTimeoutError) as error:
+        write_queue._wait(future)
+    assert error.value.written is None
+    release.set()
+    assert future.result(5) == "slow"
+    assert _marks() == ["slow"]
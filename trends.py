@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+import database
+
+# ----------------- TREND CHART DATA -----------------
+# Picks a day/week/month grain from the selected range, aggregates on the rollup tables
+# in SQL, and caps the points handed to Plotly with a min/max-preserving downsample so
+# spikes and drops stay visible even when a chart has to drop points.
+POINT_BUDGET = 3000          # max points per chart (all series together)
+MARKER_LIMIT = 400           # draw markers only on sparse charts
+
+GRAIN_LABELS = {"day": "Daily", "week": "Weekly avg", "month": "Monthly avg"}
+PANDAS_FREQ = {"day": "D", "week": "W-MON", "month": "MS"}
+
+
+def choose_grain(start_date, end_date):
+    days = (end_date - start_date).days + 1
+    if days <= 92:
+        return "day"
+    if days <= 730:
+        return "week"
+    return "month"
+
+
+def downsample_minmax(df, x, y, series, budget=POINT_BUDGET):
+    # Keeps first, last, min and max of each bucket per series (M4-style), so the
+    # envelope of the line is preserved. Returns df unchanged when within budget.
+    if len(df) <= budget or df.empty:
+        return df
+    per_series = max(budget // max(df[series].nunique(), 1), 4)
+    parts = []
+    for _, part in df.sort_values(x).groupby(series, sort=False):
+        n = len(part)
+        if n <= per_series:
+            parts.append(part)
+            continue
+        buckets = max(per_series // 4, 1)
+        bucket = np.arange(n) * buckets // n
+        values = part[y].to_numpy()
+        grouped = pd.Series(values).groupby(bucket)
+        keep = np.unique(np.concatenate([
+            grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy(),
+            grouped.head(1).index.to_numpy(), grouped.tail(1).index.to_numpy(),
+        ]))
+        parts.append(part.iloc[keep])
+    return pd.concat(parts, ignore_index=True)
+
+
+def load_trend(level, start_date, end_date, zone=None, sps_name=None, grain=None, budget=POINT_BUDGET):
+    # Returns (frame with entry_date / zone|sps_name / pumping_mld, grain used)
+    grain = grain or choose_grain(start_date, end_date)
+    key = "zone" if level == "zone" else "sps_name"
+    data = database.load_daily_rollup(level, start_date, end_date, zone=zone, sps_name=sps_name, grain=grain)
+    data = data[["entry_date", key, "pumping_mld"]]
+    return downsample_minmax(data, "entry_date", "pumping_mld", key, budget), grain
+
+
+def resample_frame(df, level, start_date, end_date, grain=None, budget=POINT_BUDGET):
+    # Same as load_trend for an already-loaded raw frame (used for per-user views,
+    # which the rollups don't cover).
+    grain = grain or choose_grain(start_date, end_date)
+    key = "zone" if level == "zone" else "sps_name"
+    daily = df.groupby(["entry_date", key])["pumping_mld"].sum().reset_index()
+    data = (
+        daily.groupby([pd.Grouper(key="entry_date", freq=PANDAS_FREQ[grain], label="left", closed="left"), key])
+        ["pumping_mld"].mean().reset_index()
+    )
+    return downsample_minmax(data, "entry_date", "pumping_mld", key, budget), grain
@@ -0,0 +1,182 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, NamedTuple, Optional
+
+import database
+import perf
+
+# ----------------- WRITE QUEUE -----------------
+# Station-log saves, deletes and batch changes and user registrations from every
+# Streamlit session in this process go through one writer thread. It takes every
+# request already waiting (up to MAX_BATCH), applies them in one transaction per
+# database, each inside its own SAVEPOINT so a failing request doesn't undo the others,
+# and commits once (group commit). Sessions wait on a Future for their own result or
+# exception. Sessions no longer compete for SQLite's write lock; the busy timeout
+# still covers other processes.
+#
+# A session that gives up after WRITE_TIMEOUT cancels its request if the writer hasn't
+# picked it up yet, so nothing is written behind its back. A request already in a
+# transaction can't be withdrawn and may still commit; WriteTimeoutError says which.
+MAX_BATCH = 256
+WRITE_TIMEOUT = 30           # seconds a session waits for its write
+
+_STOP = object()
+
+
+class WriteTimeoutError(TimeoutError):
+    def __init__(self, written):
+        self.written = written      # False: cancelled, nothing written; None: may still commit
+        if written is False:
+            message = "The save queue is busy and nothing was saved. Please try again."
+        else:
+            message = ("The save is taking longer than usual and may still go through. "
+                       "Check the entry before saving it again.")
+        super().__init__(message)
+
+
+class WriteRequest(NamedTuple):
+    path: str
+    apply: Callable                         # apply(conn) -> result, inside the batch transaction
+    after_commit: Optional[Callable]        # called once the batch is committed
+    future: Future
+
+
+_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+_stats = {"requests": 0, "batches": 0, "largest_batch": 0, "failed": 0, "cancelled": 0}
+
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run, name="write-queue", daemon=True)
+            _writer.start()
+
+
+def submit(path, apply, after_commit=None):
+    future = Future()
+    _ensure_writer()
+    _queue.put(WriteRequest(path, apply, after_commit, future))
+    return future
+
+
+def _wait(future):
+    try:
+        return future.result(WRITE_TIMEOUT)
+    except TimeoutError:
+        if future.cancel():
+            raise WriteTimeoutError(False) from None
+        if not future.done():
+            raise WriteTimeoutError(None) from None
+        return future.result()      # finished meanwhile, or the request itself raised TimeoutError
+
+
+def _run():
+    stopping = False
+    while not stopping:
+        request = _queue.get()
+        if request is _STOP:
+            break
+        batch = [request]
+        while len(batch) < MAX_BATCH:
+            try:
+                request = _queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP:
+                stopping = True
+                break
+            batch.append(request)
+        groups = {}
+        for request in batch:
+            groups.setdefault(os.path.abspath(request.path), []).append(request)
+        for requests in groups.values():
+            _commit_group(requests)
+        _stats["requests"] += len(batch)
+        _stats["batches"] += 1
+        _stats["largest_batch"] = max(_stats["largest_batch"], len(batch))
+    database.close_connections()
+
+
+def _commit_group(requests):
+    # Each request is marked running just before it is applied, so one whose session
+    # timed out and cancelled it, even behind a slow request in this batch, is skipped.
+    # Once running it can no longer be cancelled.
+    outcomes = []       # (request, ok, result or exception) for the requests applied
+    try:
+        with database.connect(requests[0].path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for request in requests:
+                if not request.future.set_running_or_notify_cancel():
+                    _stats["cancelled"] += 1
+                    continue
+                conn.execute("SAVEPOINT request")
+                try:
+                    outcomes.append((request, True, request.apply(conn)))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO request")
+                    outcomes.append((request, False, e))
+                conn.execute("RELEASE request")
+    except Exception as e:
+        # BEGIN or COMMIT failed (e.g. another process held the lock past the busy
+        # timeout): nothing in the group was written
+        for request in requests:
+            if request.future.running() or request.future.set_running_or_notify_cancel():
+                _stats["failed"] += 1
+                request.future.set_exception(e)
+        return
+    for request, ok, value in outcomes:
+        if not ok:
+            _stats["failed"] += 1
+            request.future.set_exception(value)
+            continue
+        if request.after_commit:
+            request.after_commit()
+        request.future.set_result(value)
+
+
+def shutdown():
+    # Stops the writer after the requests already queued; the next submit starts a new one
+    global _writer
+    with _writer_lock:
+        if _writer is not None and _writer.is_alive():
+            _queue.put(_STOP)
+            _writer.join()
+        _writer = None
+
+
+def stats():
+    return dict(_stats, queued=_queue.qsize())
+
+
+# ----------------- QUEUED WRITES -----------------
+# Same signatures and results as the database.py functions of the same name.
+@perf.timed()
+def save_station_entry(data, mode=database.SAVE_INSERT, expected_version=None):
+    database.check_save_mode(mode)
+    return _wait(submit(database.DB_PATH,
+                        lambda conn: database.write_station_entry(conn, data, mode, expected_version)))
+
+
+@perf.timed()
+def delete_station_entry(entry_date, sps_name):
+    return _wait(submit(database.DB_PATH,
+                        lambda conn: database.remove_station_entry(conn, entry_date, sps_name)))
+
+
+@perf.timed()
+def register_user(username, password, section, registered_by):
+    return _wait(submit(database.USER_DB_PATH,
+                        lambda conn: database.insert_user(conn, username, password, section, registered_by),
+                        after_commit=database.invalidate_user_directory))
+
+
+@perf.timed()
+def apply_entry_batch(updates=(), deletes=()):
+    updates, deletes = list(updates), list(deletes)
+    return _wait(submit(database.DB_PATH,
+                        lambda conn: database.write_entry_batch(conn, updates, deletes)))